@@ -0,0 +1,16 @@
+"""Benchmarks for the novel game server (run from the project root, e.g. ``uv run python -m benchmarks.startup``).
+
+    synthetic  N stories × M scenes (+ images) generator used by every benchmark
+    startup    catalog load: YAML vs story bundles
+    micro      loader and each tool / resource function, p50/p95/p99
+    load       many concurrent in-process players on server.py and server_tool.py
+    workers    tool-call throughput of the multi-worker SSE deployment
+    compare    diff two saved results (.cache/benchmarks/*.json)
+"""
+
+import pathlib
+import sys
+
+SRC_DIR = pathlib.Path(__file__).resolve().parent.parent / "src"
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))  # server.py / server_tool.py のモジュールは src/ 直下
@@ -0,0 +1,43 @@
+"""Compare two saved benchmark results (micro or load) operation by operation.
+
+    uv run python -m benchmarks.compare .cache/benchmarks/micro-A.json .cache/benchmarks/micro-B.json
+
+Prints p50/p95/p99 of both runs and the change in percent (negative is faster).
+"""
+
+import argparse
+import json
+import pathlib
+
+
+def _change(old: float, new: float) -> str:
+    return f"{(new - old) / old * 100:+7.1f}%" if old else "    n/a"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("base", type=pathlib.Path)
+    parser.add_argument("new", type=pathlib.Path)
+    args = parser.parse_args()
+
+    base, new = (json.loads(p.read_text(encoding="utf-8")) for p in (args.base, args.new))
+    if base["benchmark"] != new["benchmark"]:
+        parser.error(f"different benchmarks: {base['benchmark']} vs {new['benchmark']}")
+    print(f"base: {base.get('git_rev')} {base['timestamp']}")
+    print(f"new:  {new.get('git_rev')} {new['timestamp']}")
+    print(f"{'operation':<32}" + "".join(f" {p + ' base':>10} {p + ' new':>10} {'change':>8}" for p in ("p50", "p95", "p99")))
+    for name, old in base["results"].items():
+        cur = new["results"].get(name)
+        if cur is None or not old.get("n") or not cur.get("n"):
+            continue
+        row = f"{name:<32}"
+        for p in ("p50_ms", "p95_ms", "p99_ms"):
+            row += f" {old[p]:>10.3f} {cur[p]:>10.3f} {_change(old[p], cur[p]):>8}"
+        print(row)
+    if "total" in base["results"] and "total" in new["results"]:
+        old_rate, new_rate = base["results"]["total"]["calls_per_s"], new["results"]["total"]["calls_per_s"]
+        print(f"throughput: {old_rate:,.0f} → {new_rate:,.0f} calls/s ({_change(old_rate, new_rate).strip()})")
+
+
+if __name__ == "__main__":
+    main()
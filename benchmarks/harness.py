@@ -0,0 +1,98 @@
+"""Shared helpers: latency percentiles, JSON result files and servers on a synthetic catalog."""
+
+import contextlib
+from datetime import datetime, timezone
+import importlib
+import json
+import os
+import pathlib
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+RESULTS_DIR = pathlib.Path(__file__).resolve().parent.parent / ".cache" / "benchmarks"
+
+
+def summarize(samples: list[float]) -> dict:
+    """Latency summary in milliseconds (samples are seconds)."""
+    if not samples:
+        return {"n": 0}
+    ordered = sorted(samples)
+
+    def pct(p: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000, 3)
+
+    return {
+        "n": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "p50_ms": pct(50),
+        "p95_ms": pct(95),
+        "p99_ms": pct(99),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def timed(fn, *args, **kwargs) -> tuple[float, object]:
+    t = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - t, result
+
+
+def print_table(results: dict[str, dict]) -> None:
+    print(f"{'operation':<32} {'n':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, r in results.items():
+        if r.get("n"):
+            print(f"{name:<32} {r['n']:>7} {r['p50_ms']:>9.3f} {r['p95_ms']:>9.3f} {r['p99_ms']:>9.3f} {r['max_ms']:>9.3f}")
+
+
+def _git_rev() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=RESULTS_DIR.parent.parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(name: str, params: dict, results: dict, out: str | os.PathLike | None = None) -> pathlib.Path:
+    """Write ``{"benchmark", "params", "results", env...}`` to ``out`` (default: .cache/benchmarks/<name>-<time>.json)."""
+    now = datetime.now(timezone.utc)
+    path = pathlib.Path(out) if out else RESULTS_DIR / f"{name}-{now:%Y%m%dT%H%M%S}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    doc = {
+        "benchmark": name,
+        "timestamp": now.isoformat(),
+        "git_rev": _git_rev(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "params": params,
+        "results": results,
+    }
+    path.write_text(json.dumps(doc, indent=2, ensure_ascii=False), encoding="utf-8")
+    return path
+
+
+def server_env(work_dir: pathlib.Path, novel_dir: pathlib.Path) -> dict[str, str]:
+    """Environment that points a server at ``novel_dir`` with every cache / store under ``work_dir``."""
+    return {
+        "NOVEL_STORIES_DIR": str(novel_dir),
+        "NOVEL_BUNDLE_DIR": str(work_dir / "bundles"),
+        "NOVEL_IMAGE_CACHE_DIR": str(work_dir / "images"),
+        "NOVEL_SESSION_PATH": str(work_dir / "sessions.sqlite3"),
+        "NOVEL_LOG_PATH": str(work_dir / "events.sqlite3"),
+        "NOVEL_RATE_LIMIT": "0",  # 計測するのはスループットなので上限はかけない
+    }
+
+
+def quiet():
+    """Send anything the servers print to stderr so stdout only carries results."""
+    return contextlib.redirect_stdout(sys.stderr)
+
+
+def import_servers(env: dict[str, str], names=("server", "server_tool")) -> dict:
+    """Import the server modules configured by ``env`` (they read it at import time)."""
+    os.environ.update(env)
+    with quiet():
+        return {name: importlib.import_module(name) for name in names}
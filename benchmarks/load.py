@@ -0,0 +1,152 @@
+"""In-process load generator: many concurrent players walking random branches.
+
+    uv run python -m benchmarks.load --players 50 --steps 40 --server both
+
+Each player is an MCP client connected in memory to ``server.py`` (resources
+for state and scenes) or ``server_tool.py`` (tools), so every call pays the
+real JSON-RPC dispatch and serialization. A step reads the player's state and
+scene, loads the scene image (when there is one) and picks a random choice.
+Per-operation p50/p95/p99 latencies and the overall throughput are printed
+and saved as JSON (see ``--out``).
+"""
+
+import argparse
+import asyncio
+import json
+import pathlib
+import random
+import tempfile
+import time
+
+from fastmcp import Client
+
+from benchmarks import harness
+from benchmarks.synthetic import generate_catalog
+
+
+class Recorder:
+    def __init__(self):
+        self.samples: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+
+    async def call(self, name: str, coro):
+        t = time.perf_counter()
+        try:
+            return await coro
+        except Exception:
+            self.errors[name] = self.errors.get(name, 0) + 1
+            return None
+        finally:
+            self.samples.setdefault(name, []).append(time.perf_counter() - t)
+
+
+def _json(contents):
+    return json.loads(contents[0].text) if contents else {}
+
+
+async def _tool_player(mcp, rec: Recorder, rng: random.Random, player_id: str, story_id: str,
+                       steps: int, think: float, size: int, image_args: dict) -> None:
+    async with Client(mcp) as client:
+        images = set(_json(await rec.call("server_tool.list_story_images", client.call_tool(
+            "list_story_images", {"story_id": story_id}))) or [])
+        await rec.call("server_tool.select_story", client.call_tool("select_story", {"player_id": player_id, "story_id": story_id}))
+        for _ in range(steps):
+            state = _json(await rec.call("server_tool.get_story_state", client.call_tool(
+                "get_story_state", {"story_id": story_id, "player_id": player_id})))
+            scene_id = state.get("scene_id")
+            scene = _json(await rec.call("server_tool.get_scene", client.call_tool(
+                "get_scene", {"story_id": story_id, "scene_id": scene_id})))
+            if scene_id in images:
+                await rec.call("server_tool.load_scene_image", client.call_tool(
+                    "load_scene_image", {"player_id": player_id, "scene_id": scene_id, "max_width": size, "max_height": size, **image_args}))
+            choices = scene.get("choices") or []
+            if not choices:
+                await rec.call("server_tool.select_story", client.call_tool("select_story", {"player_id": player_id, "story_id": story_id}))
+                continue
+            await rec.call("server_tool.choose", client.call_tool("choose", {
+                "player_id": player_id, "current_scene_id": scene_id, "choice_id": rng.choice(choices)["id"]}))
+            if think:
+                await asyncio.sleep(rng.expovariate(1 / think))
+
+
+async def _resource_player(mcp, rec: Recorder, rng: random.Random, player_id: str, story_id: str,
+                           steps: int, think: float, size: int, image_args: dict) -> None:
+    async with Client(mcp) as client:
+        images = set(_json(await rec.call("server.story_images", client.read_resource(
+            f"novelgame://story/{story_id}/images"))) or [])
+        await rec.call("server.select_story", client.call_tool("select_story", {"player_id": player_id, "story_id": story_id}))
+        for _ in range(steps):
+            state = _json(await rec.call("server.player_state", client.read_resource(
+                f"novelgame://player/{player_id}/state/{story_id}")))
+            scene_id = state.get("scene_id")
+            scene = _json(await rec.call("server.story_scene", client.read_resource(
+                f"novelgame://story/{story_id}/scenes/{scene_id}")))
+            if scene_id in images:
+                await rec.call("server.load_scene_image", client.call_tool(
+                    "load_scene_image", {"player_id": player_id, "scene_id": scene_id, "max_width": size, "max_height": size, **image_args}))
+            choices = scene.get("choices") or []
+            if not choices:
+                await rec.call("server.select_story", client.call_tool("select_story", {"player_id": player_id, "story_id": story_id}))
+                continue
+            await rec.call("server.choose", client.call_tool("choose", {
+                "player_id": player_id, "current_scene_id": scene_id, "choice_id": rng.choice(choices)["id"]}))
+            if think:
+                await asyncio.sleep(rng.expovariate(1 / think))
+
+
+async def run_load(servers: dict, which: str, players: int, steps: int, think: float, size: int, seed: int,
+                   image_format: str | None = None) -> tuple[dict, float]:
+    rec = Recorder()
+    rng = random.Random(seed)
+    image_args = {"format": image_format} if image_format else {}
+    stories = sorted(servers["server_tool"].SCENES)
+    tasks = []
+    for i in range(players):
+        kind = which if which != "both" else ("server_tool" if i % 2 else "server")
+        player = _tool_player if kind == "server_tool" else _resource_player
+        tasks.append(player(servers[kind].mcp, rec, random.Random(rng.random()), f"load-{i}",
+                            stories[i % len(stories)], steps, think, size, image_args))
+    t = time.perf_counter()
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - t
+    results = {name: harness.summarize(s) for name, s in sorted(rec.samples.items())}
+    for name, count in rec.errors.items():
+        results[name]["errors"] = count
+    total = sum(len(s) for s in rec.samples.values())
+    results["total"] = {"calls": total, "seconds": round(elapsed, 3), "calls_per_s": round(total / elapsed, 1)}
+    return results, elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", choices=("server", "server_tool", "both"), default="both")
+    parser.add_argument("--players", type=int, default=50)
+    parser.add_argument("--steps", type=int, default=40, help="choices per player")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="mean think time between steps")
+    parser.add_argument("--stories", type=int, default=4)
+    parser.add_argument("--scenes", type=int, default=100, help="scenes per story")
+    parser.add_argument("--image-size", type=int, nargs=2, default=(1600, 1200), metavar=("W", "H"))
+    parser.add_argument("--image-ratio", type=float, default=0.2, help="fraction of scenes with an image")
+    parser.add_argument("--max-size", type=int, default=1024, help="max_width/max_height for load_scene_image")
+    parser.add_argument("--image-format", help='load_scene_image format, e.g. "webp" (default: source PNG/JPEG)')
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="result JSON path (default: .cache/benchmarks/load-<time>.json)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = pathlib.Path(tmp)
+        novel_dir = generate_catalog(tmp / "stories", args.stories, args.scenes, seed=args.seed,
+                                     image_size=tuple(args.image_size), image_ratio=args.image_ratio)
+        servers = harness.import_servers(harness.server_env(tmp, novel_dir))
+        with harness.quiet():
+            results, _ = asyncio.run(run_load(servers, args.server, args.players, args.steps,
+                                              args.think_ms / 1000, args.max_size, args.seed, args.image_format))
+
+    harness.print_table(results)
+    total = results["total"]
+    print(f"{total['calls']} calls in {total['seconds']:.1f} s = {total['calls_per_s']:,.0f} calls/s")
+    print(f"saved {harness.save_results('load', vars(args), results, args.out)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Micro-benchmarks for the story loader and each tool / resource function.
+
+    uv run python -m benchmarks.micro --stories 5 --scenes 200 --iterations 500
+
+Functions are called directly (no MCP framing) on a synthetic catalog;
+``load_scene_image`` is measured cold (first encode of an image) and warm
+(variant cache hit). Prefetching is disabled so cold encodes stay cold.
+Results are printed and saved as JSON (see ``--out``).
+"""
+
+import argparse
+import asyncio
+import pathlib
+import random
+import tempfile
+import time
+
+from benchmarks import harness
+from benchmarks.synthetic import generate_catalog
+
+import story_loader
+
+
+def bench_loader(novel_dir: pathlib.Path, bundle_dir: pathlib.Path, repeat: int) -> dict:
+    results = {}
+    scene_files = sorted(novel_dir.glob("*/*.yaml"))
+    scene_files = [f for f in scene_files if f.name != "meta.yaml"][:500]
+    results["loader.parse_scene_file"] = harness.summarize(
+        [harness.timed(story_loader.parse_scene_file, f)[0] for f in scene_files]
+    )
+    results["loader.load_catalog(yaml)"] = harness.summarize(
+        [harness.timed(story_loader.load_catalog, novel_dir, None)[0] for _ in range(repeat)]
+    )
+    story_loader.load_catalog(novel_dir, bundle_dir)  # バンドルを作っておく
+    results["loader.load_catalog(bundle)"] = harness.summarize(
+        [harness.timed(story_loader.load_catalog, novel_dir, bundle_dir)[0] for _ in range(repeat)]
+    )
+    return results
+
+
+async def bench_tools(servers: dict, iterations: int, seed: int, image_format: str | None = None) -> dict:
+    rng = random.Random(seed)
+    st, sv = servers["server_tool"], servers["server"]
+    story_id = sorted(st.SCENES)[0]
+    scene_ids = list(st.SCENES[story_id])
+    samples: dict[str, list[float]] = {}
+
+    def run(name: str, fn, *args, **kwargs):
+        elapsed, result = harness.timed(fn, *args, **kwargs)
+        samples.setdefault(name, []).append(elapsed)
+        return result
+
+    async def arun(name: str, fn, *args):
+        t = time.perf_counter()
+        result = await fn(*args)
+        samples.setdefault(name, []).append(time.perf_counter() - t)
+        return result
+
+    for i in range(iterations):
+        scene_id = rng.choice(scene_ids)
+        run("server_tool.list_stories", st.list_stories)
+        run("server_tool.get_story_meta", st.get_story_meta, story_id)
+        run("server_tool.get_scene", st.get_scene, story_id, scene_id)
+        await arun("server_tool.get_story_graph", st.get_story_graph, story_id)
+        await arun("server_tool.get_reachable_scenes", st.get_reachable_scenes, story_id, scene_id)
+        run("server.stories_index", sv.stories_index)
+        run("server.story_scene", sv.story_scene, story_id, scene_id)
+
+        player_id = f"micro-{i % 50}"
+        if i % 10 == 0 or st.SESSIONS.state(player_id, story_id) is None:
+            run("server_tool.select_story", st.select_story, player_id, story_id)
+        state = st.SESSIONS.state(player_id)
+        choices = st.SCENES[story_id][state.scene_id].get("choices") or [{"id": "a"}]
+        run("server_tool.choose", st.choose, player_id, state.scene_id, rng.choice(choices)["id"])
+        run("server_tool.get_story_state", st.get_story_state, story_id, player_id)
+        run("server.player_state", sv.player_state, player_id, story_id)
+        turn = run("server_tool.play_turn", st.play_turn, player_id, None)
+        if turn["choices"]:
+            run("server_tool.play_turn(choice)", st.play_turn, player_id, rng.choice(turn["choices"])["id"])
+
+    # 画像: 未エンコードの画像で cold、同じ画像の再要求で warm を測る
+    st.select_story("micro-image", story_id)
+    for scene_id in list(st.IMAGES.get(story_id, {}))[: max(1, iterations // 10)]:
+        for name in ("cold", "warm"):
+            t = time.perf_counter()
+            await st.load_scene_image("micro-image", scene_id, 1024, 1024, image_format)
+            samples.setdefault(f"server_tool.load_scene_image({name})", []).append(time.perf_counter() - t)
+    return {name: harness.summarize(s) for name, s in samples.items()}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stories", type=int, default=5)
+    parser.add_argument("--scenes", type=int, default=200, help="scenes per story")
+    parser.add_argument("--image-size", type=int, nargs=2, default=(1600, 1200), metavar=("W", "H"))
+    parser.add_argument("--image-ratio", type=float, default=0.1, help="fraction of scenes with an image")
+    parser.add_argument("--image-format", help='load_scene_image format, e.g. "webp" (default: source PNG/JPEG)')
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=3, help="loader repetitions")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="result JSON path (default: .cache/benchmarks/micro-<time>.json)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = pathlib.Path(tmp)
+        novel_dir = generate_catalog(tmp / "stories", args.stories, args.scenes, seed=args.seed,
+                                     image_size=tuple(args.image_size), image_ratio=args.image_ratio)
+        results = bench_loader(novel_dir, tmp / "loader-bundles", args.repeat)
+        env = harness.server_env(tmp, novel_dir)
+        env["NOVEL_PREFETCH"] = "0"
+        servers = harness.import_servers(env)
+        with harness.quiet():
+            results.update(asyncio.run(bench_tools(servers, args.iterations, args.seed, args.image_format)))
+
+    harness.print_table(results)
+    print(f"saved {harness.save_results('micro', vars(args), results, args.out)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Catalog startup time: serial vs parallel YAML parsing vs compiled story bundles.
+
+    uv run python -m benchmarks.startup --stories 20 --scenes 500 --workers 4
+"""
+
+import argparse
+import os
+import pathlib
+import statistics
+import tempfile
+import time
+
+from benchmarks.synthetic import generate_catalog
+
+import story_loader
+
+
+def _time(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t)
+    return statistics.median(samples)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stories", type=int, default=20)
+    parser.add_argument("--scenes", type=int, default=500, help="scenes per story")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="processes for the parallel YAML run")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = pathlib.Path(tmp)
+        novel_dir = generate_catalog(tmp / "stories", args.stories, args.scenes)
+        bundle_dir = tmp / "bundles"
+        total = args.stories * args.scenes
+        print(f"catalog: {args.stories} stories × {args.scenes} scenes = {total} scenes")
+
+        yaml_s = _time(lambda: story_loader.load_catalog(novel_dir, None, workers=1), args.repeat)
+        parallel_s = _time(lambda: story_loader.load_catalog(novel_dir, None, workers=args.workers), args.repeat)
+        used = story_loader.load_catalog(novel_dir, None, workers=args.workers).workers  # 小さいカタログは逐次になる
+        t = time.perf_counter()
+        story_loader.load_catalog(novel_dir, bundle_dir)  # YAML + バンドル書き出し
+        build_s = time.perf_counter() - t
+        bundle_s = _time(lambda: story_loader.load_catalog(novel_dir, bundle_dir), args.repeat)
+
+        print(f"yaml:          {yaml_s:8.3f} s  ({total / yaml_s:,.0f} scenes/s)")
+        print(f"yaml ×{used:<3}       {parallel_s:8.3f} s  ({total / parallel_s:,.0f} scenes/s, {yaml_s / parallel_s:.1f}x faster)")
+        print(f"bundle build:  {build_s:8.3f} s")
+        print(f"bundle load:   {bundle_s:8.3f} s  ({total / bundle_s:,.0f} scenes/s, {yaml_s / bundle_s:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
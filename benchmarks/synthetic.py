@@ -0,0 +1,64 @@
+"""Synthetic story catalogs shaped like src/stories/<story_id>/ (scene YAML, meta.yaml, images/)."""
+
+import pathlib
+import random
+
+from PIL import Image
+import yaml
+
+_WORDS = (
+    "castle mist river lantern whisper gear tower rose letter garden shadow "
+    "霧 歯車 薔薇 手紙 城 塔 影 庭園 運命 記憶"
+).split()
+
+
+def _paragraph(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(words))
+
+
+def _image(rng: random.Random, size: tuple[int, int], path: pathlib.Path) -> None:
+    # 低解像度のノイズを拡大する: 単色よりも実際の挿絵に近い圧縮率になる
+    w, h = size
+    small = (max(1, w // 16), max(1, h // 16))
+    noise = Image.frombytes("RGB", small, rng.randbytes(3 * small[0] * small[1]))
+    noise.resize(size, Image.Resampling.BICUBIC).save(path)
+
+
+def generate_catalog(
+    out_dir: str | pathlib.Path,
+    stories: int = 20,
+    scenes: int = 500,
+    choices: int = 3,
+    body_words: int = 80,
+    seed: int = 0,
+    image_size: tuple[int, int] | None = None,
+    image_ratio: float = 1.0,
+    image_format: str = "png",
+) -> pathlib.Path:
+    """Write ``stories`` × ``scenes`` scene YAML files (plus meta.yaml) under ``out_dir``.
+
+    With ``image_size`` a distinct ``images/<scene_id>.<image_format>`` of that
+    size is written for ``image_ratio`` of the scenes.
+    """
+    rng = random.Random(seed)
+    out_dir = pathlib.Path(out_dir)
+    for s in range(stories):
+        story_dir = out_dir / f"synthetic_{s:03d}"
+        story_dir.mkdir(parents=True, exist_ok=True)
+        meta = {"title": f"Synthetic {s}", "author": "bench", "lang": "en", "description": _paragraph(rng, 20)}
+        (story_dir / "meta.yaml").write_text(yaml.safe_dump(meta, allow_unicode=True), encoding="utf-8")
+        scene_ids = ["intro"] + [f"scene_{i:05d}" for i in range(1, scenes)]
+        for scene_id in scene_ids:
+            doc = {
+                "id": scene_id,
+                "body_md": f"## {scene_id}\n{_paragraph(rng, body_words)}\n",
+                "choices": [
+                    {"id": chr(ord("a") + c), "text": _paragraph(rng, 4), "next": rng.choice(scene_ids)}
+                    for c in range(choices)
+                ],
+            }
+            (story_dir / f"{scene_id}.yaml").write_text(yaml.safe_dump(doc, allow_unicode=True), encoding="utf-8")
+            if image_size is not None and rng.random() < image_ratio:
+                (story_dir / "images").mkdir(exist_ok=True)
+                _image(rng, image_size, story_dir / "images" / f"{scene_id}.{image_format}")
+    return out_dir
@@ -0,0 +1,92 @@
+"""Tool-call throughput over HTTP/SSE with 1..N worker processes behind the sticky router.
+
+    uv run python -m benchmarks.workers --workers 1 2 4 --clients 16 --seconds 10
+
+Each client is one player connected to ``/sse?player_id=...`` and plays a
+synthetic story in a loop (``choose`` → ``get_story_state`` → ``get_scene``).
+Throughput only scales up to the number of CPU cores.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import pathlib
+import subprocess
+import sys
+import tempfile
+import time
+
+from fastmcp import Client
+from fastmcp.client.transports import SSETransport
+
+from benchmarks.synthetic import generate_catalog
+
+import workers
+
+ROUTER = workers.ROOT / "workers.py"
+
+
+async def _player(url: str, player_id: str, deadline: float) -> int:
+    calls = 0
+    async with Client(SSETransport(f"{url}/sse?player_id={player_id}")) as client:
+        opening = json.loads((await client.call_tool("select_story", {"player_id": player_id, "story_id": "synthetic_000"}))[0].text)
+        scene_id = opening["scene_id"]
+        calls += 1
+        while time.monotonic() < deadline:
+            await client.call_tool("choose", {"player_id": player_id, "current_scene_id": scene_id, "choice_id": "a"})
+            state = json.loads((await client.call_tool("get_story_state", {"story_id": "synthetic_000", "player_id": player_id}))[0].text)
+            scene_id = state["scene_id"]
+            await client.call_tool("get_scene", {"story_id": "synthetic_000", "scene_id": scene_id})
+            calls += 3
+    return calls
+
+
+async def _drive(url: str, clients: int, seconds: float) -> int:
+    deadline = time.monotonic() + seconds
+    counts = await asyncio.gather(*(_player(url, f"bench-{i}", deadline) for i in range(clients)))
+    return sum(counts)
+
+
+def run(count: int, clients: int, seconds: float, port: int, env: dict[str, str]) -> float:
+    router = subprocess.Popen(
+        [sys.executable, str(ROUTER), "--server", "server_tool", "--workers", str(count), "--port", str(port)],
+        env=env, stdin=subprocess.DEVNULL,
+    )
+    try:
+        workers.wait_ready("127.0.0.1", [port] + [port + 1 + i for i in range(count)])
+        calls = asyncio.run(_drive(f"http://127.0.0.1:{port}", clients, seconds))
+    finally:
+        router.terminate()  # SIGTERM → uvicorn 終了 → finally でワーカーも止まる
+        router.wait(timeout=30)
+    return calls / seconds
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--port", type=int, default=8700)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = pathlib.Path(tmp)
+        env = {
+            **os.environ,
+            "NOVEL_STORIES_DIR": str(generate_catalog(tmp / "stories", stories=1, scenes=200)),
+            "NOVEL_BUNDLE_DIR": str(tmp / "bundles"),
+            "NOVEL_SESSION_PATH": str(tmp / "sessions.sqlite3"),
+            "NOVEL_LOG_PATH": str(tmp / "events.sqlite3"),
+            "NOVEL_RATE_LIMIT": "0",
+        }
+        print(f"cpu cores: {os.cpu_count()}, clients: {args.clients}, {args.seconds:.0f}s per run")
+        base = None
+        for count in args.workers:
+            rate = run(count, args.clients, args.seconds, args.port, env)
+            base = base or rate
+            print(f"workers={count:<3d} {rate:10,.0f} tool calls/s  ({rate / base:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,475 @@
+"""Persistent, append-only story event log.
+
+``LOG.append(story_id, event)`` only touches memory: the event goes onto a
+queue drained by a background group-commit writer, which writes everything
+queued (up to ``batch_size`` events, waiting at most ``max_delay`` seconds) in
+one transaction / file append. Committed events are also kept, with their
+backend sequence numbers, in a bounded per-story ring buffer.
+
+Reads are paginated: :meth:`EventLog.query` returns at most ``limit`` events
+after an opaque cursor, optionally filtered by time range, event type and
+player. A cursor at or past the oldest event in the ring (i.e. polling for new
+events) is answered from memory; older pages use backend indexes rather than
+scanning the whole log. Reads never wait for the writer, so they can trail
+``append`` by up to ``max_delay`` (call :meth:`EventLog.flush` off the event
+loop first when that matters). :meth:`EventLog.export_chunk` returns exports
+to clients as JSONL text in size-bounded chunks with the same cursors.
+
+When several processes write the same backend (``NOVEL_LOG_SHARED=1``, set by
+workers.py) the ring would miss the other processes' events, so every read
+goes to the backend.
+
+Configuration (environment):
+    NOVEL_LOG_BACKEND  "sqlite" (default, WAL mode), "jsonl" (segmented files) or "memory" (ring buffer only)
+    NOVEL_LOG_PATH     database file or segment directory (default: .cache/events.sqlite3 / .cache/events)
+    NOVEL_LOG_RING     recent events kept in memory per story (default: 1000)
+    NOVEL_LOG_SHARED   "1": the backend is shared with other processes (default: 0)
+"""
+
+from bisect import bisect_left, bisect_right
+from collections import defaultdict, deque
+from collections.abc import Iterator
+from dataclasses import dataclass
+from datetime import datetime, timezone
+import atexit
+import json
+import logging
+import os
+import pathlib
+import queue
+import sqlite3
+import threading
+import urllib.parse
+
+logger = logging.getLogger("novelgame.event_log")
+
+ROOT = pathlib.Path(__file__).parent
+DEFAULT_DIR = ROOT.parent / ".cache"
+MAX_PAGE = 1000
+EXPORT_CHUNK_BYTES = 512 * 1024  # MCP のメッセージ上限（1MB）に収まる大きさ
+
+
+def event_player(event: dict) -> str | None:
+    """player_id of an event ("start" has it at top level, "choice" in payload)."""
+    return event.get("player_id") or (event.get("payload") or {}).get("player_id")
+
+
+def normalize_ts(value: str | None) -> str | None:
+    """ISO 8601 timestamp → the UTC form written by ``now_ts`` (so strings compare in time order)."""
+    if value is None:
+        return None
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc).isoformat()
+
+
+@dataclass(frozen=True, slots=True)
+class LogFilter:
+    since: str | None = None  # inclusive, normalized ISO timestamp
+    until: str | None = None  # inclusive
+    event: str | None = None
+    player_id: str | None = None
+
+    def matches(self, ts: str, event: str, player_id: str | None) -> bool:
+        return ((self.since is None or ts >= self.since)
+                and (self.until is None or ts <= self.until)
+                and (self.event is None or event == self.event)
+                and (self.player_id is None or player_id == self.player_id))
+
+
+class LogBackend:
+    """Storage for events. ``write_batch`` is only called from the writer thread."""
+
+    persistent = True
+
+    def write_batch(self, events: list[tuple[str, dict]]) -> list[int]:
+        """Store ``events``; returns the seq assigned to each, in the same order."""
+        raise NotImplementedError
+
+    def query(self, story_id: str, after: int, limit: int, flt: LogFilter) -> list[tuple[int, dict]]:
+        """Up to ``limit`` (seq, event) pairs with seq > ``after`` matching ``flt``, in order."""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryLogBackend(LogBackend):
+    """No persistence: reads are served from the ring buffer (see EventLog.read)."""
+
+    persistent = False
+
+    def write_batch(self, events: list[tuple[str, dict]]) -> list[int]:
+        return []
+
+    def query(self, story_id: str, after: int, limit: int, flt: LogFilter) -> list[tuple[int, dict]]:
+        return []
+
+
+class SqliteLogBackend(LogBackend):
+    def __init__(self, path: str | os.PathLike):
+        self.path = str(path)
+        pathlib.Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._write_conn = self._connect()
+        self._write_conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS events (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                story_id TEXT NOT NULL,
+                ts TEXT NOT NULL,
+                event TEXT NOT NULL,
+                player_id TEXT,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS events_story ON events (story_id, seq);
+            CREATE INDEX IF NOT EXISTS events_story_event ON events (story_id, event, seq);
+            CREATE INDEX IF NOT EXISTS events_story_player ON events (story_id, player_id, seq);
+            CREATE INDEX IF NOT EXISTS events_story_ts ON events (story_id, ts);
+            """
+        )
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30.0, check_same_thread=False)  # 他のワーカーの書き込み待ち
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")  # WAL ではコミット毎の fsync を省略しても壊れない
+        return conn
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def write_batch(self, events: list[tuple[str, dict]]) -> list[int]:
+        with self._write_conn:
+            self._write_conn.executemany(
+                "INSERT INTO events (story_id, ts, event, player_id, data) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (story_id, e.get("ts", ""), e.get("event", ""), event_player(e), json.dumps(e, ensure_ascii=False))
+                    for story_id, e in events
+                ],
+            )
+            # 1 トランザクション内の AUTOINCREMENT は連番（他の書き手は割り込めない）
+            last = self._write_conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+        return list(range(last - len(events) + 1, last + 1))
+
+    def query(self, story_id: str, after: int, limit: int, flt: LogFilter) -> list[tuple[int, dict]]:
+        sql = "SELECT seq, data FROM events WHERE story_id = ? AND seq > ?"
+        params: list = [story_id, after]
+        for clause, value in (("ts >= ?", flt.since), ("ts <= ?", flt.until),
+                              ("event = ?", flt.event), ("player_id = ?", flt.player_id)):
+            if value is not None:
+                sql += f" AND {clause}"
+                params.append(value)
+        rows = self._reader().execute(sql + " ORDER BY seq LIMIT ?", (*params, limit))
+        return [(seq, json.loads(data)) for seq, data in rows]
+
+    def close(self) -> None:
+        self._write_conn.close()
+
+
+class _JsonlIndex:
+    """Per-story in-memory index over the JSONL segments; seq is the 1-based line number."""
+
+    def __init__(self):
+        self.locations: list[tuple[int, int]] = []  # seq-1 → (segment number, byte offset)
+        self.ts: list[str] = []  # 追記順 = 時刻順なので二分探索できる
+        self.events: list[str] = []
+        self.players: list[str | None] = []
+        self.by_event: dict[str, list[int]] = defaultdict(list)  # event → seqs
+        self.by_player: dict[str, list[int]] = defaultdict(list)  # player_id → seqs
+
+    def add(self, segment: int, offset: int, event: dict) -> int:
+        self.locations.append((segment, offset))
+        seq = len(self.locations)
+        player = event_player(event)
+        self.ts.append(event.get("ts", ""))
+        self.events.append(event.get("event", ""))
+        self.players.append(player)
+        self.by_event[event.get("event", "")].append(seq)
+        if player is not None:
+            self.by_player[player].append(seq)
+        return seq
+
+    def candidates(self, after: int, flt: LogFilter) -> Iterator[int]:
+        """Seqs > ``after`` from the most selective posting list (or the since/until range)."""
+        start = max(after + 1, bisect_left(self.ts, flt.since) + 1 if flt.since is not None else 1)
+        stop = bisect_right(self.ts, flt.until) if flt.until is not None else len(self.ts)
+        postings = []
+        if flt.event is not None:
+            postings.append(self.by_event.get(flt.event, []))
+        if flt.player_id is not None:
+            postings.append(self.by_player.get(flt.player_id, []))
+        if postings:
+            seqs = min(postings, key=len)
+            for i in range(bisect_left(seqs, start), bisect_right(seqs, stop)):
+                yield seqs[i]
+        else:
+            yield from range(start, stop + 1)
+
+
+class JsonlLogBackend(LogBackend):
+    """One directory per story holding numbered ``NNNNNN.jsonl`` segments."""
+
+    def __init__(self, root: str | os.PathLike, segment_bytes: int = 8 * 1024 * 1024):
+        self.root = pathlib.Path(root)
+        self.segment_bytes = segment_bytes
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._indexes: dict[str, _JsonlIndex] = {}
+        self._lock = threading.Lock()
+
+    def _index(self, story_id: str) -> _JsonlIndex:
+        """Build the story's index on first use with one pass over its segments."""
+        with self._lock:
+            index = self._indexes.get(story_id)
+            if index is None:
+                index = self._indexes[story_id] = _JsonlIndex()
+                for segment in self.segments(story_id):
+                    offset = 0
+                    with open(segment, "rb") as f:
+                        for line in f:
+                            if line.strip():
+                                index.add(int(segment.stem), offset, json.loads(line))
+                            offset += len(line)
+            return index
+
+    def _story_dir(self, story_id: str) -> pathlib.Path:
+        return self.root / urllib.parse.quote(story_id, safe="")  # "../" などを無害化
+
+    def segments(self, story_id: str) -> list[pathlib.Path]:
+        story_dir = self._story_dir(story_id)
+        if not story_dir.is_dir():
+            return []
+        return sorted(story_dir.glob("*.jsonl"))
+
+    def write_batch(self, events: list[tuple[str, dict]]) -> list[int]:
+        by_story: dict[str, list[dict]] = defaultdict(list)
+        for story_id, e in events:
+            by_story[story_id].append(e)
+        seqs: dict[str, list[int]] = defaultdict(list)
+        for story_id, story_events in by_story.items():
+            index = self._index(story_id)
+            segments = self.segments(story_id)
+            if segments and segments[-1].stat().st_size < self.segment_bytes:
+                segment = segments[-1]
+            else:
+                number = int(segments[-1].stem) + 1 if segments else 0
+                segment = self._story_dir(story_id) / f"{number:06d}.jsonl"
+                segment.parent.mkdir(parents=True, exist_ok=True)
+            with open(segment, "ab") as f:
+                offset = f.tell()
+                for e in story_events:
+                    line = (json.dumps(e, ensure_ascii=False) + "\n").encode("utf-8")
+                    f.write(line)
+                    with self._lock:
+                        seqs[story_id].append(index.add(int(segment.stem), offset, e))
+                    offset += len(line)
+        order = {story_id: iter(story_seqs) for story_id, story_seqs in seqs.items()}
+        return [next(order[story_id]) for story_id, _ in events]
+
+    def query(self, story_id: str, after: int, limit: int, flt: LogFilter) -> list[tuple[int, dict]]:
+        index = self._index(story_id)
+        hits = []
+        with self._lock:  # 書き込みスレッドの追記と並行しないように
+            for seq in index.candidates(after, flt):
+                i = seq - 1
+                if flt.matches(index.ts[i], index.events[i], index.players[i]):
+                    hits.append((seq, index.locations[i]))
+                    if len(hits) >= limit:
+                        break
+        result = []
+        files: dict[int, object] = {}
+        try:
+            for seq, (segment, offset) in hits:
+                f = files.get(segment)
+                if f is None:
+                    f = files[segment] = open(self._story_dir(story_id) / f"{segment:06d}.jsonl", "rb")
+                f.seek(offset)
+                result.append((seq, json.loads(f.readline())))
+        finally:
+            for f in files.values():
+                f.close()
+        return result
+
+
+class EventLog:
+    """Ring buffer of recent events in front of a group-committed backend."""
+
+    def __init__(self, backend: LogBackend, ring_size: int = 1000, batch_size: int = 512, max_delay: float = 0.05,
+                 shared: bool = False):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.shared = shared  # 他プロセスも同じバックエンドに書く: リングは完全ではないので使わない
+        self.recent: dict[str, deque[tuple[int, dict]]] = defaultdict(lambda: deque(maxlen=ring_size))
+        self._recent_seq: dict[str, int] = defaultdict(int)  # memory バックエンドの seq
+        self._ring_lock = threading.Lock()
+        self.ring_reads = 0
+        self.backend_reads = 0
+        self.commits = 0
+        self.committed = 0
+        self._queue: queue.Queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="event-log", daemon=True)
+        self._thread.start()
+
+    def append(self, story_id: str, event: dict) -> None:
+        if self.backend.persistent:
+            self._queue.put((story_id, event))  # リングにはコミット後に seq 付きで入る
+            return
+        with self._ring_lock:
+            self._recent_seq[story_id] += 1
+            self.recent[story_id].append((self._recent_seq[story_id], event))
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            batch, waiters = [], []
+            while True:
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                elif item is None:
+                    self._commit(batch)
+                    for w in waiters:
+                        w.set()
+                    return
+                else:
+                    batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    # 一定時間内に届いたイベントをまとめて 1 トランザクションで書く
+                    item = self._queue.get(timeout=self.max_delay) if not waiters else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            self._commit(batch)
+            for w in waiters:
+                w.set()
+
+    def _commit(self, batch: list[tuple[str, dict]]) -> None:
+        if not batch:
+            return
+        try:
+            seqs = self.backend.write_batch(batch)
+            self.commits += 1
+            self.committed += len(batch)
+        except Exception as e:  # 書き込み失敗でサーバーを止めない
+            logger.error("Error writing %d log events: %s", len(batch), e)
+            return
+        if not self.shared:
+            with self._ring_lock:
+                for (story_id, event), seq in zip(batch, seqs):
+                    self.recent[story_id].append((seq, event))
+
+    def flush(self, timeout: float | None = 5.0) -> None:
+        """Block until everything appended so far is committed (not on the event loop)."""
+        if self._closed:
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def query(self, story_id: str, cursor: str | None = None, limit: int = 100,
+              since: str | None = None, until: str | None = None,
+              event: str | None = None, player_id: str | None = None) -> dict:
+        """One page of committed events: ``{"events": [...], "next_cursor": str | None}``.
+
+        Pass ``next_cursor`` back as ``cursor`` for the following page. With the
+        memory backend only the ring buffer is searched.
+        """
+        limit = max(1, min(limit, MAX_PAGE))
+        flt = LogFilter(normalize_ts(since), normalize_ts(until), event, player_id)
+        rows = self._rows(story_id, int(cursor) if cursor else 0, limit + 1, flt)
+        more = len(rows) > limit
+        rows = rows[:limit]
+        return {
+            "events": [e for _, e in rows],
+            "next_cursor": str(rows[-1][0]) if more else None,
+        }
+
+    def _rows(self, story_id: str, after: int, limit: int, flt: LogFilter) -> list[tuple[int, dict]]:
+        rows = self._ring_page(story_id, after, limit, flt)
+        if rows is None:
+            self.backend_reads += 1
+            rows = self.backend.query(story_id, after, limit, flt)
+        return rows
+
+    def _ring_page(self, story_id: str, after: int, limit: int, flt: LogFilter) -> list[tuple[int, dict]] | None:
+        """Rows from the ring, or None when it may not hold every event after ``after``."""
+        with self._ring_lock:
+            ring = self.recent.get(story_id)
+            if self.backend.persistent:
+                # リングの最古のイベント以降だけは完全（それより前はバックエンドにしかない）
+                if self.shared or not ring or after < ring[0][0]:
+                    return None
+            self.ring_reads += 1
+            rows = []
+            for seq, e in ring or ():
+                if seq > after and flt.matches(e.get("ts", ""), e.get("event", ""), event_player(e)):
+                    rows.append((seq, e))
+                    if len(rows) >= limit:
+                        break
+            return rows
+
+    def export_chunk(self, story_id: str, cursor: str | None = None, max_bytes: int = EXPORT_CHUNK_BYTES,
+                     since: str | None = None, until: str | None = None,
+                     event: str | None = None, player_id: str | None = None) -> dict:
+        """Up to ``max_bytes`` of matching events as JSONL: ``{"jsonl", "events", "next_cursor"}``.
+
+        Blocking (reads the backend page by page); call it off the event loop.
+        Always returns at least one event when there is one.
+        """
+        flt = LogFilter(normalize_ts(since), normalize_ts(until), event, player_id)
+        after = int(cursor) if cursor else 0
+        lines, size = [], 0
+        while True:
+            rows = self._rows(story_id, after, MAX_PAGE, flt)
+            for seq, e in rows:
+                line = json.dumps(e, ensure_ascii=False) + "\n"
+                n = len(line.encode("utf-8"))
+                if lines and size + n > max_bytes:
+                    return {"jsonl": "".join(lines), "events": len(lines), "next_cursor": str(after)}
+                lines.append(line)
+                size += n
+                after = seq
+            if len(rows) < MAX_PAGE:
+                return {"jsonl": "".join(lines), "events": len(lines), "next_cursor": None}
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._closed = True
+        self.backend.close()
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self.backend).__name__,
+            "pending": self._queue.qsize(),
+            "commits": self.commits,
+            "committed": self.committed,
+            "recent": sum(len(d) for d in self.recent.values()),
+            "ring_reads": self.ring_reads,
+            "backend_reads": self.backend_reads,
+        }
+
+
+def from_env() -> EventLog:
+    """Build the log from NOVEL_LOG_BACKEND / NOVEL_LOG_PATH / NOVEL_LOG_RING / NOVEL_LOG_SHARED; flushed at exit."""
+    kind = os.environ.get("NOVEL_LOG_BACKEND", "sqlite")
+    path = os.environ.get("NOVEL_LOG_PATH")
+    if kind == "sqlite":
+        backend = SqliteLogBackend(path or DEFAULT_DIR / "events.sqlite3")
+    elif kind == "jsonl":
+        backend = JsonlLogBackend(path or DEFAULT_DIR / "events")
+    elif kind == "memory":
+        backend = MemoryLogBackend()
+    else:
+        raise ValueError(f"Unknown NOVEL_LOG_BACKEND: {kind}")
+    log = EventLog(backend, ring_size=int(os.environ.get("NOVEL_LOG_RING", 1000)),
+                   shared=os.environ.get("NOVEL_LOG_SHARED", "0") == "1")
+    atexit.register(log.close)
+    return log
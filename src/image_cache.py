@@ -0,0 +1,220 @@
+"""Persistent, content-addressed cache of resized scene images.
+
+Variants are stored as ``<cache_dir>/<key>.<ext>`` where ``key`` is derived from
+the SHA-256 of the source file plus (max_width, max_height, format, preset), so
+editing an image automatically misses the cache. The directory is bounded by
+``max_bytes`` and evicts least recently used variants first. Hits are returned
+as a memoryview of a read-only memory map, so the file is never copied into a
+``bytes`` object before base64 encoding.
+
+Recency is kept in the files' mtimes and the directory is rescanned every
+``SYNC_INTERVAL`` seconds when variants are added, so the bound applies to the
+on-disk total even when several processes (workers.py, process encoders)
+share the directory. Between rescans each process may overshoot by what the
+others wrote in the meantime.
+
+Warm-up (pre-render common sizes for every scene image of NOVEL_STORIES_DIR)::
+
+    uv run src/image_cache.py --sizes 1024x1024 512x512
+"""
+
+from collections import OrderedDict
+import hashlib
+import logging
+import mmap
+import os
+import pathlib
+import threading
+import time
+
+from imaging import EncodedImage, encode_scene_image, encode_stats
+
+logger = logging.getLogger("novelgame.image_cache")
+
+ROOT = pathlib.Path(__file__).parent
+DEFAULT_CACHE_DIR = ROOT.parent / ".cache" / "images"
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_WARM_SIZES = ((1024, 1024), (512, 512))
+SYNC_INTERVAL = 5.0  # 秒; 他プロセスが書いたファイルを数え直す間隔
+
+_EXT_FORMAT = {".png": "PNG", ".jpg": "JPEG", ".webp": "WEBP", ".avif": "AVIF"}
+_FORMAT_EXT = {v: k for k, v in _EXT_FORMAT.items()}
+
+
+class VariantCache:
+    """Size-bounded LRU cache of encoded image variants on disk."""
+
+    def __init__(self, cache_dir: str | os.PathLike, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, int] = OrderedDict()  # file name → size (oldest first)
+        self._total = 0
+        self._source_hashes: dict[str, tuple[int, int, str]] = {}  # path → (mtime_ns, size, sha256)
+        self._synced = 0.0
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            self._scan()
+
+    def _scan(self) -> None:
+        """Rebuild the index from the directory (mtime order = LRU order across processes). Needs the lock."""
+        stats = []
+        for p in self.cache_dir.iterdir():
+            if p.suffix not in _EXT_FORMAT:
+                continue
+            try:
+                stats.append((p.name, p.stat()))
+            except FileNotFoundError:
+                pass  # 他プロセスが追い出した
+        self._entries.clear()
+        self._total = 0
+        for name, st in sorted(stats, key=lambda item: item[1].st_mtime_ns):
+            self._entries[name] = st.st_size
+            self._total += st.st_size
+        self._synced = time.monotonic()
+        self._evict()
+
+    def source_hash(self, image_path: str) -> str:
+        """SHA-256 of the source file, memoized until its mtime or size changes."""
+        st = os.stat(image_path)
+        cached = self._source_hashes.get(image_path)
+        if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            return cached[2]
+        h = hashlib.sha256()
+        with open(image_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        self._source_hashes[image_path] = (st.st_mtime_ns, st.st_size, digest)
+        return digest
+
+    def variant_key(self, image_path: str, max_width: int, max_height: int,
+                    format: str | None = None, preset: str | None = None) -> str:
+        # 既定（元の形式、balanced）は None で渡すので、形式指定の追加前に作ったキーがそのまま使える
+        params = f"{max_width}x{max_height}:{format or 'source'}:{preset or 'auto'}"
+        return hashlib.sha256(f"{self.source_hash(image_path)}:{params}".encode()).hexdigest()
+
+    def get(self, key: str) -> tuple[memoryview, str] | None:
+        """Return (data, format) for a cached variant, or None. ``data`` is backed by a read-only mmap."""
+        with self._lock:
+            for ext, fmt in _EXT_FORMAT.items():
+                name = key + ext
+                if name in self._entries:
+                    self._entries.move_to_end(name)
+                    expected = self._entries[name]
+                    break
+            else:
+                self.misses += 1
+                return None
+        path = self.cache_dir / name
+        try:
+            with open(path, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                if size == 0 or size < expected:
+                    # 書き込み途中で落ちた残骸など; mmap は長さ 0 のファイルを扱えない
+                    raise ValueError(f"truncated variant file ({size} of {expected} bytes)")
+                # マップはファイルを閉じても（追い出しで削除されても）有効で、参照がなくなると解放される
+                data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            os.utime(path)  # 再起動後も（他プロセスから見ても）LRU 順を保つ
+        except (OSError, ValueError) as e:
+            if not isinstance(e, FileNotFoundError):
+                logger.warning("Dropping unreadable cached variant %s: %s", name, e)
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+            with self._lock:
+                self._total -= self._entries.pop(name, 0)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data, fmt
+
+    def put(self, key: str, encoded: EncodedImage) -> None:
+        name = key + _FORMAT_EXT[encoded.format]
+        path = self.cache_dir / name
+        tmp = path.with_name(f".{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(encoded.data)
+        os.replace(tmp, path)
+        with self._lock:
+            if time.monotonic() - self._synced > SYNC_INTERVAL:
+                self._scan()  # 他プロセスの書き込みも予算に含める
+            self._total -= self._entries.pop(name, 0)
+            self._entries[name] = len(encoded.data)
+            self._total += len(encoded.data)
+            self._evict()
+
+    def _evict(self) -> None:
+        while self._total > self.max_bytes and self._entries:
+            name, size = self._entries.popitem(last=False)
+            self._total -= size
+            try:
+                (self.cache_dir / name).unlink()
+            except FileNotFoundError:
+                pass
+            except PermissionError:
+                pass  # Windows: まだマップされている; 次回の _scan で数え直す
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def from_env() -> VariantCache:
+    """Build the cache from NOVEL_IMAGE_CACHE_DIR / NOVEL_IMAGE_CACHE_MAX_BYTES."""
+    return VariantCache(
+        os.environ.get("NOVEL_IMAGE_CACHE_DIR", DEFAULT_CACHE_DIR),
+        int(os.environ.get("NOVEL_IMAGE_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)),
+    )
+
+
+def warm(cache: VariantCache, images: dict[str, dict[str, str]],
+         sizes=DEFAULT_WARM_SIZES) -> int:
+    """Pre-render ``sizes`` for every story/scene image. Returns the number of variants rendered."""
+    rendered = 0
+    for story_id, scenes in images.items():
+        for scene_id, image_path in scenes.items():
+            for max_width, max_height in sizes:
+                key = cache.variant_key(image_path, max_width, max_height)
+                if cache.get(key) is not None:
+                    continue
+                try:
+                    cache.put(key, encode_scene_image(image_path, max_width, max_height))
+                    rendered += 1
+                except Exception as e:
+                    logger.error("Error rendering %s/%s at %dx%d: %s", story_id, scene_id, max_width, max_height, e)
+    return rendered
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Pre-render scene image variants into the cache.")
+    parser.add_argument("--sizes", nargs="+", default=[f"{w}x{h}" for w, h in DEFAULT_WARM_SIZES],
+                        help="WIDTHxHEIGHT bounds to render (default: %(default)s)")
+    args = parser.parse_args()
+
+    import metrics
+    import scene_cache
+    import story_loader
+
+    metrics.configure_logging()
+    # シーン ID の索引だけで画像の一覧は作れる（サーバーを起動する必要はない）
+    novel_dir = pathlib.Path(os.environ.get("NOVEL_STORIES_DIR", ROOT / "stories"))
+    catalog = story_loader.load_catalog(novel_dir, story_loader.bundle_dir_from_env(), scene_cache.SceneCache())
+    images = {story.story_id: story.images for story in catalog.stories if story.images}
+
+    cache = from_env()
+    sizes = [tuple(int(v) for v in s.lower().split("x")) for s in args.sizes]
+    count = warm(cache, images, sizes)
+    logger.info("Rendered %d variants: %s", count, cache.stats())
+    logger.info("Encode passes: %s", encode_stats())
@@ -0,0 +1,52 @@
+"""Chunked delivery of original scene images.
+
+``load_scene_image`` re-encodes every image to fit the 1MB message budget,
+which means heavy lossy recompression (or an error) for large illustrations.
+This module serves the untouched source file instead, in fixed-size chunks
+that a client fetches one by one and concatenates. Each chunk is sliced out of
+a read-only memory map, so only the requested range is read.
+
+Configuration (environment):
+    NOVEL_IMAGE_CHUNK  chunk size in bytes (default: 524288; base64 makes it 4/3 larger on the wire)
+"""
+
+import base64
+import math
+import mmap
+import os
+
+CHUNK_SIZE = int(os.environ.get("NOVEL_IMAGE_CHUNK", 512 * 1024))
+
+_MIME_TYPES = {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg"}
+
+
+def describe(image_path: str, sha256: str, chunk_size: int = CHUNK_SIZE) -> dict:
+    """File name, MIME type, size, SHA-256 and chunk layout of an original image."""
+    size = os.path.getsize(image_path)
+    return {
+        "file": os.path.basename(image_path),
+        "mime_type": _MIME_TYPES.get(os.path.splitext(image_path)[1].lower(), "application/octet-stream"),
+        "size": size,
+        "sha256": sha256,
+        "chunk_size": chunk_size,
+        "chunks": max(1, math.ceil(size / chunk_size)),
+    }
+
+
+def _read(image_path: str, index: int, chunk_size: int, convert):
+    with open(image_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        chunks = max(1, math.ceil(len(mm) / chunk_size))
+        if not 0 <= index < chunks:
+            raise ValueError(f"Chunk {index} out of range for {os.path.basename(image_path)} (0..{chunks - 1})")
+        with memoryview(mm)[index * chunk_size:(index + 1) * chunk_size] as view:
+            return convert(view)
+
+
+def read_chunk(image_path: str, index: int, chunk_size: int = CHUNK_SIZE) -> bytes:
+    """Raw bytes of chunk ``index``."""
+    return _read(image_path, index, chunk_size, bytes)
+
+
+def read_chunk_base64(image_path: str, index: int, chunk_size: int = CHUNK_SIZE) -> str:
+    """Chunk ``index`` base64-encoded straight from the mapped file (no intermediate bytes copy)."""
+    return _read(image_path, index, chunk_size, lambda view: base64.b64encode(view).decode("ascii"))
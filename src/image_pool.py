@@ -0,0 +1,192 @@
+"""Run scene image encoding off the event loop.
+
+``load_scene_image`` awaits :meth:`ImagePool.render`, which serves cached
+variants directly and hands encodes to a bounded thread or process pool.
+Concurrent requests for the same (image, size) share one in-flight encode,
+and requests beyond ``max_queue`` are rejected instead of piling up.
+
+Process workers are forked (see :meth:`ImagePool.start`) rather than spawned:
+spawn and forkserver children re-import ``__main__``, which for the servers
+means loading the catalog, opening the session / event-log stores and starting
+their threads once per worker. Where fork is unavailable (Windows) the
+process executor falls back to threads.
+
+Configuration (environment):
+    NOVEL_IMAGE_EXECUTOR  "thread" (default; Pillow releases the GIL) or "process"
+    NOVEL_IMAGE_WORKERS   concurrent encodes (default: min(4, cpu count))
+    NOVEL_IMAGE_QUEUE     max requests waiting or running (default: 32)
+"""
+
+import asyncio
+from collections import Counter
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+import logging
+import multiprocessing
+import os
+from typing import NamedTuple
+
+from image_cache import VariantCache
+from imaging import ENCODE_PASSES, EncodedImage, encode_scene_image
+from metrics import LATENCY_BUCKETS, Histogram
+
+logger = logging.getLogger("novelgame.image_pool")
+
+_SOURCE_FORMATS = {".png": "PNG", ".jpg": "JPEG", ".jpeg": "JPEG"}
+
+
+class Rendered(NamedTuple):
+    data: bytes | memoryview
+    format: str  # "PNG" / "JPEG" / "WEBP" / "AVIF"
+    encode_seconds: float | None  # None: served from the variant cache
+
+
+class ImagePoolBusy(RuntimeError):
+    """Raised when too many image requests are already queued. Safe to retry."""
+
+
+def _consume_exception(task: asyncio.Task) -> None:
+    if not task.cancelled():
+        task.exception()  # 待機者が全員キャンセルされても "never retrieved" 警告を出さない
+
+
+class ImagePool:
+    def __init__(self, cache: VariantCache, workers: int = 4, max_queue: int = 32, kind: str = "thread"):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown image executor kind: {kind}")
+        if kind == "process" and "fork" not in multiprocessing.get_all_start_methods():
+            logger.warning("Process image executor needs fork(); using threads instead")
+            kind = "thread"
+        self.cache = cache
+        self.workers = workers
+        self.max_queue = max_queue
+        self.kind = kind
+        self._executor: Executor | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+        self._inflight: dict[tuple[str, int, int, str | None, str], asyncio.Task] = {}
+        self._pending = 0
+        self.shared = 0  # requests served by another request's in-flight encode
+        self.rejected = 0
+        self.encode_seconds = Histogram(LATENCY_BUCKETS)
+        self.source_bytes = 0  # originals encoded so far
+        self.encoded_bytes = 0  # what they became
+        self.format_encodes: Counter[str] = Counter()
+        self.format_saved: Counter[str] = Counter()  # bytes saved per output format
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                # spawn / forkserver は子プロセスで __main__（サーバー）を再実行するので fork を使う
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("fork"))
+            else:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="image")
+        return self._executor
+
+    def start(self) -> None:
+        """Fork the process workers now; call before the server starts its background threads."""
+        if self.kind == "process":
+            self._get_executor().submit(int).result()  # fork コンテキストでは最初の submit で全ワーカーを起動する
+
+    async def render(self, image_path: str, max_width: int, max_height: int,
+                     format: str | None = None, preset: str = "balanced") -> Rendered:
+        """Return the variant without blocking the event loop (format / preset: see imaging.encode_scene_image).
+
+        Cache hits are a memoryview of the mapped variant file (see VariantCache.get).
+        """
+        if format == _SOURCE_FORMATS.get(os.path.splitext(image_path)[1].lower()):
+            format = None  # 元と同じ形式の明示指定は既定と同じバリアントを使う
+        key = (image_path, max_width, max_height, format, preset)
+        task = self._inflight.get(key)
+        if task is not None:
+            self.shared += 1
+            return await asyncio.shield(task)
+
+        if self._pending >= self.max_queue:
+            self.rejected += 1
+            raise ImagePoolBusy(
+                f"Image encoder is busy ({self._pending} requests queued). Please retry shortly."
+            )
+
+        # エンコードは最初の呼び出し元から切り離したタスクで行う: 誰がキャンセルされても
+        # 共有している他の待機者には結果が届き、キャッシュにも保存される
+        task = asyncio.get_running_loop().create_task(self._run(key, image_path, max_width, max_height, format, preset))
+        task.add_done_callback(_consume_exception)
+        self._inflight[key] = task
+        self._pending += 1
+        return await asyncio.shield(task)
+
+    async def _run(self, key, image_path: str, max_width: int, max_height: int,
+                   format: str | None, preset: str) -> Rendered:
+        try:
+            return await self._render(image_path, max_width, max_height, format, preset)
+        finally:
+            self._pending -= 1
+            del self._inflight[key]
+
+    def _lookup(self, image_path: str, max_width: int, max_height: int,
+                format: str | None, preset: str) -> tuple[str, tuple[memoryview, str] | None]:
+        key = self.cache.variant_key(image_path, max_width, max_height, format, None if preset == "balanced" else preset)
+        return key, self.cache.get(key)
+
+    async def _render(self, image_path: str, max_width: int, max_height: int,
+                      format: str | None, preset: str) -> Rendered:
+        # ハッシュ計算とキャッシュ読み込みもファイル I/O なのでループ外で行う
+        key, cached = await asyncio.to_thread(self._lookup, image_path, max_width, max_height, format, preset)
+        if cached is not None:
+            return Rendered(*cached, None)
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.workers)
+        async with self._semaphore:
+            encoded: EncodedImage = await asyncio.get_running_loop().run_in_executor(
+                self._get_executor(), encode_scene_image, image_path, max_width, max_height, format, preset
+            )
+        self.encode_seconds.observe(encoded.encode_seconds)
+        self.source_bytes += encoded.source_bytes
+        self.encoded_bytes += len(encoded.data)
+        self.format_encodes[encoded.format] += 1
+        self.format_saved[encoded.format] += encoded.source_bytes - len(encoded.data)
+        if self.kind == "process":
+            ENCODE_PASSES[encoded.passes] += 1  # 子プロセス側のカウンタは親に届かない
+        await asyncio.to_thread(self.cache.put, key, encoded)
+        return Rendered(encoded.data, encoded.format, encoded.encode_seconds)
+
+    def backlog(self) -> int:
+        """Requests waiting for or running an encode (rate_limit sheds image requests on this)."""
+        return self._pending
+
+    def idle_workers(self) -> int:
+        """Workers not busy with (or reserved by) a request; prefetch only uses these."""
+        return self.workers - self._pending
+
+    def stats(self) -> dict:
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "pending": self._pending,
+            "inflight": len(self._inflight),
+            "shared": self.shared,
+            "rejected": self.rejected,
+            "encodes": self.encode_seconds.count,
+            "encode_seconds": round(self.encode_seconds.sum, 3),
+            "source_bytes": self.source_bytes,
+            "encoded_bytes": self.encoded_bytes,
+            "bytes_saved": self.source_bytes - self.encoded_bytes,
+            **{f"encodes_{fmt.lower()}": n for fmt, n in self.format_encodes.items()},
+            **{f"bytes_saved_{fmt.lower()}": n for fmt, n in self.format_saved.items()},
+        }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+def from_env(cache: VariantCache) -> ImagePool:
+    """Build the pool from NOVEL_IMAGE_EXECUTOR / NOVEL_IMAGE_WORKERS / NOVEL_IMAGE_QUEUE."""
+    return ImagePool(
+        cache,
+        workers=int(os.environ.get("NOVEL_IMAGE_WORKERS", min(4, os.cpu_count() or 1))),
+        max_queue=int(os.environ.get("NOVEL_IMAGE_QUEUE", 32)),
+        kind=os.environ.get("NOVEL_IMAGE_EXECUTOR", "thread"),
+    )
@@ -0,0 +1,175 @@
+"""Scene image encoding shared by server.py and server_tool.py.
+
+Images are re-emitted in their source format (PNG / JPEG) unless the client
+asks for another one; WebP and AVIF are offered when this Pillow build can
+encode them (see ``FORMATS`` and :func:`negotiate`). A preset trades size for
+quality on the lossy formats.
+"""
+
+from collections import Counter
+from dataclasses import dataclass
+import io
+import math
+import os
+import time
+
+from PIL import Image as PILImage
+from PIL import features
+
+MAX_IMAGE_BYTES = 1048576  # 1MB (MCP クライアントに渡す上限)
+MIN_SIZE = 50
+MIN_QUALITY = 40
+
+
+# 1 回目のエンコード結果から bytes/pixel を外挿して目標サイズを予測する。
+# 予算ちょうどを狙うと僅かに超えることがあるので少し余裕を持たせる。
+TARGET_RATIO = 0.92
+MAX_PASSES = 6
+
+ENCODE_PASSES: Counter[int] = Counter()  # passes per request → request count
+
+PRESETS = ("quality", "balanced", "size")
+# 非可逆形式の初期 quality（balanced の JPEG は従来どおり 85）
+QUALITY = {
+    "JPEG": {"quality": 92, "balanced": 85, "size": 70},
+    "WEBP": {"quality": 90, "balanced": 80, "size": 65},
+    "AVIF": {"quality": 80, "balanced": 63, "size": 50},
+}
+
+
+def _has_module(name: str) -> bool:
+    try:
+        return features.check_module(name)
+    except ValueError:  # この Pillow が知らない形式（古い Pillow の avif など）
+        return False
+
+
+# このビルドでエンコードできる形式（小さい順）
+FORMATS = tuple(f for f, ok in (("AVIF", _has_module("avif")), ("WEBP", _has_module("webp")),
+                                  ("JPEG", True), ("PNG", True)) if ok)
+
+
+def negotiate(accept: str | None) -> str | None:
+    """First format in ``accept`` (comma-separated, by preference) that can be encoded here.
+
+    None, "" or "source" keep the source format (returns None).
+    """
+    if not accept:
+        return None
+    for name in accept.split(","):
+        name = name.strip().upper()
+        name = "JPEG" if name == "JPG" else name
+        if name == "SOURCE":
+            return None
+        if name in FORMATS:
+            return name
+    raise ValueError(f"None of the requested formats ({accept}) can be encoded here; available: "
+                     f"{', '.join(f.lower() for f in FORMATS)}")
+
+
+@dataclass(frozen=True, slots=True)
+class EncodedImage:
+    data: bytes
+    format: str  # "PNG" / "JPEG"
+    width: int
+    height: int
+    quality: int | None
+    passes: int = 1
+    source_bytes: int = 0  # size of the original file
+    encode_seconds: float = 0.0
+
+
+def _encode(img: PILImage.Image, size: tuple[int, int], ext: str, quality: int | None,
+            preset: str = "balanced") -> tuple[bytes, tuple[int, int]]:
+    img_copy = img.copy()
+    img_copy.thumbnail(size, PILImage.LANCZOS)
+    buf = io.BytesIO()
+    if ext == "JPEG":
+        if img_copy.mode not in ("L", "RGB", "CMYK"):
+            img_copy = img_copy.convert("RGB")
+        img_copy.save(buf, format="JPEG", quality=quality)
+    elif ext in ("WEBP", "AVIF"):
+        if img_copy.mode not in ("RGB", "RGBA"):
+            has_alpha = "A" in img_copy.mode or "transparency" in img_copy.info
+            img_copy = img_copy.convert("RGBA" if has_alpha else "RGB")
+        if ext == "WEBP":
+            img_copy.save(buf, format="WEBP", quality=quality, method=6 if preset == "size" else 4)
+        else:
+            # speed 8 は 6 の約 4 倍速くサイズは 1 割増し程度（1024px で 0.15s 対 0.6s）
+            img_copy.save(buf, format="AVIF", quality=quality, speed=6 if preset == "size" else 8)
+    else:
+        img_copy.save(buf, format="PNG", optimize=True, compress_level=9)
+    return buf.getvalue(), img_copy.size
+
+
+def predict_scale(size: int, budget: int = MAX_IMAGE_BYTES) -> float:
+    """Linear scale factor expected to bring an encode of ``size`` bytes under ``budget``.
+
+    Encoded size grows roughly with pixel count, i.e. with the square of the scale.
+    """
+    return min(0.95, math.sqrt(budget * TARGET_RATIO / size))
+
+
+def encode_scene_image(image_path: str, max_width: int = 1024, max_height: int = 1024,
+                       format: str | None = None, preset: str = "balanced") -> EncodedImage:
+    """Resize and compress the image at ``image_path`` so that data size <= 1MB.
+
+    ``format`` is one of FORMATS (None: the source's PNG / JPEG), ``preset`` one of PRESETS.
+    Usually needs one encode (already fits) or two (size predicted from the first).
+    """
+    if preset not in PRESETS:
+        raise ValueError(f"Unknown preset: {preset} (use {', '.join(PRESETS)})")
+    if format is not None and format not in FORMATS:
+        raise ValueError(f"Cannot encode {format} here; available: {', '.join(FORMATS)}")
+    started = time.perf_counter()
+    with PILImage.open(image_path) as img:
+        ext = format or ("JPEG" if (img.format or "PNG").upper() in ("JPEG", "JPG") else "PNG")
+        width, height = img.size
+        cur_width, cur_height = min(width, max_width), min(height, max_height)
+        quality = QUALITY[ext][preset] if ext in QUALITY else None
+        img.load()
+
+        passes = 0
+        while True:
+            data, (out_width, out_height) = _encode(img, (cur_width, cur_height), ext, quality, preset)
+            passes += 1
+            size = len(data)
+            if size <= MAX_IMAGE_BYTES or passes >= MAX_PASSES:
+                break
+            if out_width <= MIN_SIZE or out_height <= MIN_SIZE:
+                break
+            scale = predict_scale(size)
+            # 非可逆形式で大幅に超えている場合はqualityも下げる
+            if quality is not None and quality > MIN_QUALITY and scale < 0.7:
+                quality = max(MIN_QUALITY, int(quality * 0.8))
+                scale = min(0.95, scale * 1.25)  # quality を下げた分だけ縮小を控えめに
+            cur_width = max(MIN_SIZE, int(out_width * scale))
+            cur_height = max(MIN_SIZE, int(out_height * scale))
+        ENCODE_PASSES[passes] += 1
+        if size > MAX_IMAGE_BYTES:
+            raise ValueError(
+                f"Image is too large even after repeated resizing/compression. "
+                f"Original: {width}x{height}, Final: {out_width}x{out_height}, Size: {size} bytes, Quality: {quality}"
+            )
+        return EncodedImage(
+            data=data,
+            format=ext,
+            width=out_width,
+            height=out_height,
+            quality=quality,
+            passes=passes,
+            source_bytes=os.path.getsize(image_path),
+            encode_seconds=time.perf_counter() - started,
+        )
+
+
+def encode_stats() -> dict:
+    """Encode passes per request, for checking how often the size prediction misses."""
+    requests = sum(ENCODE_PASSES.values())
+    passes = sum(n * count for n, count in ENCODE_PASSES.items())
+    return {
+        "requests": requests,
+        "passes": passes,
+        "mean_passes": passes / requests if requests else 0.0,
+        "histogram": dict(sorted(ENCODE_PASSES.items())),
+    }
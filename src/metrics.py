@@ -0,0 +1,272 @@
+"""Server metrics and logging setup.
+
+:func:`instrument` wraps every function registered through ``mcp.tool()`` /
+``mcp.resource()`` afterwards and records, per tool or resource, the call
+count, errors, a latency histogram and a payload-size histogram. Functions
+stay callable directly (``batch``, ``play_turn``, benchmarks); only calls
+dispatched by MCP are counted.
+
+Payload sizes of text, pre-serialized JSON (response_cache.CachedJSON) and
+images are read off the result. Other structured results would have to be
+serialized a second time just to be measured, so only one call in
+NOVEL_METRICS_PAYLOAD_SAMPLE is; their payload histogram is a sample.
+
+Component statistics (image cache and pool, scene cache, prefetch, sessions,
+event log) are registered as sources and reported as gauges. Everything is
+available as a JSON snapshot (``get_server_metrics``) or in the Prometheus
+text exposition format.
+
+Logging goes to stderr (stdout is the stdio transport) under the
+``novelgame`` logger namespace. Debug output is only formatted when enabled.
+
+Configuration (environment):
+    NOVEL_LOGGING_LEVEL           DEBUG / INFO (default) / WARNING / ERROR
+    NOVEL_METRICS_PAYLOAD_SAMPLE  measure 1 in N structured responses (default: 16, 1 = every call)
+"""
+
+from bisect import bisect_left
+from collections.abc import Callable, Sequence
+import functools
+import inspect
+import logging
+import os
+import sys
+import threading
+import time
+
+import pydantic_core
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # 秒
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)  # バイト
+
+
+def configure_logging() -> None:
+    """Send ``novelgame.*`` logs to stderr at NOVEL_LOGGING_LEVEL (idempotent)."""
+    logger = logging.getLogger("novelgame")
+    if logger.handlers:
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(os.environ.get("NOVEL_LOGGING_LEVEL", "INFO").upper())
+    logger.propagate = False
+
+
+class Histogram:
+    """Fixed-bucket histogram (Prometheus style: counts per upper bound, plus sum and count)."""
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)  # 最後は +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float | None:
+        """Upper bound of the bucket holding the q-quantile (None when empty or beyond the last bound)."""
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        for bound, n in zip(self.bounds, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return None
+
+    def to_dict(self, scale: float = 1.0, unit: str = "") -> dict:
+        def q(p: float):
+            v = self.quantile(p)
+            return round(v * scale, 3) if v is not None else None
+
+        return {
+            "count": self.count,
+            f"mean{unit}": round(self.sum / self.count * scale, 3) if self.count else None,
+            f"p50{unit}": q(0.50),
+            f"p95{unit}": q(0.95),
+            f"p99{unit}": q(0.99),
+        }
+
+
+class CallStats:
+    __slots__ = ("calls", "errors", "latency", "payload")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.payload = Histogram(SIZE_BUCKETS)
+
+
+def payload_size(result, serialize: bool = True) -> int | None:
+    """Approximate response size in bytes; None for a structured result when ``serialize`` is false."""
+    if isinstance(result, (bytes, bytearray, memoryview)):
+        return memoryview(result).nbytes
+    if isinstance(result, str):
+        return len(result) if result.isascii() else len(result.encode("utf-8"))  # CachedJSON は ASCII
+    data = getattr(result, "data", None)  # fastmcp.Image
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return memoryview(data).nbytes
+    if isinstance(result, list) and any(hasattr(item, "data") for item in result):  # [Image, レポート]
+        return sum(payload_size(item) or 0 for item in result)
+    if not serialize:
+        return None
+    return len(pydantic_core.to_json(result, fallback=str))
+
+
+class Metrics:
+    def __init__(self, payload_sample: int = 16):
+        self.payload_sample = max(1, payload_sample)
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._calls: dict[tuple[str, str], CallStats] = {}
+        self._sources: dict[str, Callable[[], dict]] = {}
+        self._histograms: dict[str, tuple[Histogram, str]] = {}
+
+    def add_source(self, name: str, stats: Callable[[], dict]) -> None:
+        """Report ``stats()`` (a flat dict, numbers become gauges) under ``name``."""
+        self._sources[name] = stats
+
+    def add_histogram(self, name: str, hist: Histogram, help_text: str) -> None:
+        """Export a histogram owned by a component (e.g. image encode seconds)."""
+        self._histograms[name] = (hist, help_text)
+
+    def _observe(self, stats: CallStats, elapsed: float, result=None, error: bool = False) -> None:
+        # 構造化された結果の再シリアライズは payload_sample 回に 1 回だけ（各ツールの初回を含む）
+        size = payload_size(result, stats.calls % self.payload_sample == 0) if not error else None
+        with self._lock:
+            stats.calls += 1
+            stats.latency.observe(elapsed)
+            if error:
+                stats.errors += 1
+            elif size is not None:
+                stats.payload.observe(size)
+
+    def wrap(self, kind: str, name: str, fn: Callable) -> Callable:
+        stats = self._calls.setdefault((kind, name), CallStats())
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def timed(*args, **kwargs):
+                t = time.perf_counter()
+                try:
+                    result = await fn(*args, **kwargs)
+                except BaseException:
+                    self._observe(stats, time.perf_counter() - t, error=True)
+                    raise
+                self._observe(stats, time.perf_counter() - t, result)
+                return result
+        else:
+            @functools.wraps(fn)
+            def timed(*args, **kwargs):
+                t = time.perf_counter()
+                try:
+                    result = fn(*args, **kwargs)
+                except BaseException:
+                    self._observe(stats, time.perf_counter() - t, error=True)
+                    raise
+                self._observe(stats, time.perf_counter() - t, result)
+                return result
+        return timed
+
+    def snapshot(self) -> dict:
+        """JSON-friendly view; percentiles are bucket upper bounds, i.e. approximate."""
+        uptime = time.time() - self.started
+        with self._lock:
+            calls = {
+                f"{kind}:{name}": {
+                    "calls": s.calls,
+                    "errors": s.errors,
+                    "per_s": round(s.calls / uptime, 3) if uptime > 0 else None,
+                    "latency": s.latency.to_dict(1000, "_ms"),
+                    "payload": s.payload.to_dict(1, "_bytes"),
+                }
+                for (kind, name), s in sorted(self._calls.items())
+                if s.calls  # 未使用のものは省く（Prometheus 形式では 0 として出す）
+            }
+        histograms = {name: hist.to_dict(1000, "_ms") for name, (hist, _) in self._histograms.items()}
+        return {
+            "uptime_s": round(uptime, 1),
+            "calls": calls,
+            "histograms": histograms,
+            **{name: fn() for name, fn in self._sources.items()},
+        }
+
+    def prometheus(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = [
+            "# HELP novelgame_uptime_seconds Seconds since the server started.",
+            "# TYPE novelgame_uptime_seconds gauge",
+            f"novelgame_uptime_seconds {time.time() - self.started:.3f}",
+        ]
+        with self._lock:
+            items = sorted(self._calls.items())
+            lines += ["# HELP novelgame_calls_total MCP tool / resource calls.", "# TYPE novelgame_calls_total counter"]
+            lines += [f'novelgame_calls_total{{kind="{k}",name="{n}"}} {s.calls}' for (k, n), s in items]
+            lines += ["# HELP novelgame_errors_total Calls that raised.", "# TYPE novelgame_errors_total counter"]
+            lines += [f'novelgame_errors_total{{kind="{k}",name="{n}"}} {s.errors}' for (k, n), s in items]
+            for metric, attr, help_text in (
+                ("novelgame_call_duration_seconds", "latency", "Call latency."),
+                ("novelgame_response_bytes", "payload", "Response payload size."),
+            ):
+                lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} histogram"]
+                for (k, n), s in items:
+                    lines += histogram_lines(metric, getattr(s, attr), f'kind="{k}",name="{n}"')
+        for name, (hist, help_text) in self._histograms.items():
+            metric = f"novelgame_{name}"
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} histogram"]
+            lines += histogram_lines(metric, hist)
+        for source, fn in self._sources.items():
+            for key, value in fn().items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                metric = f"novelgame_{source}_{key}"
+                lines += [f"# TYPE {metric} gauge", f"{metric} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+def histogram_lines(metric: str, hist: Histogram, labels: str = "") -> list[str]:
+    sep = "," if labels else ""
+    lines, cumulative = [], 0
+    for bound, n in zip(hist.bounds, hist.counts):
+        cumulative += n
+        lines.append(f'{metric}_bucket{{{labels}{sep}le="{bound:g}"}} {cumulative}')
+    lines.append(f'{metric}_bucket{{{labels}{sep}le="+Inf"}} {hist.count}')
+    lines.append(f"{metric}_sum{{{labels}}} {hist.sum:.6f}" if labels else f"{metric}_sum {hist.sum:.6f}")
+    lines.append(f"{metric}_count{{{labels}}} {hist.count}" if labels else f"{metric}_count {hist.count}")
+    return lines
+
+
+def instrument(mcp, registry: Metrics) -> None:
+    """Wrap every function registered through ``mcp.tool()`` / ``mcp.resource()`` from now on."""
+    tool, resource = mcp.tool, mcp.resource
+
+    def tool_decorator(*args, **kwargs):
+        register = tool(*args, **kwargs)
+
+        def decorator(fn):
+            register(registry.wrap("tool", kwargs.get("name") or fn.__name__, fn))
+            return fn  # 直接呼び出し（batch など）は計測しない
+
+        return decorator
+
+    def resource_decorator(uri: str, **kwargs):
+        register = resource(uri, **kwargs)
+
+        def decorator(fn):
+            register(registry.wrap("resource", kwargs.get("name") or fn.__name__, fn))
+            return fn
+
+        return decorator
+
+    mcp.tool = tool_decorator
+    mcp.resource = resource_decorator
+
+
+def from_env() -> Metrics:
+    """Build the registry from NOVEL_METRICS_PAYLOAD_SAMPLE."""
+    return Metrics(payload_sample=int(os.environ.get("NOVEL_METRICS_PAYLOAD_SAMPLE", 16)))
@@ -0,0 +1,140 @@
+"""Speculative prefetch of the scenes a player is likely to visit next.
+
+After ``select_story`` / ``choose`` the servers call :meth:`Prefetcher.schedule`
+with the player's current scene. The current scene and every ``next`` target
+of its choices are warmed in the background: the resized image variant (at
+the size the client last asked for) through :class:`image_pool.ImagePool`,
+so a ``load_scene_image`` that arrives mid-encode shares it, and, in lazy
+mode, the parsed scene document.
+
+Prefetch only uses idle capacity: at most ``max_inflight`` prefetches run at
+once, and none start while the image pool has no free worker. Anything over
+the budget is skipped, never queued.
+
+Each player's prefetched items are remembered until their next move: items
+the player requests count as ``used``; items for scenes the player did not
+move to count as ``wasted``.
+
+Configuration (environment):
+    NOVEL_PREFETCH           "0" to disable (default: on)
+    NOVEL_PREFETCH_INFLIGHT  max concurrent prefetches (default: 2)
+"""
+
+import asyncio
+from collections.abc import Awaitable, Callable, Mapping
+import logging
+import os
+
+from image_pool import ImagePool
+from scene_cache import LazyScenes
+
+logger = logging.getLogger("novelgame.prefetch")
+
+Item = tuple  # ("image", story_id, scene_id, width, height, format, preset) | ("scene", story_id, scene_id)
+
+
+class Prefetcher:
+    def __init__(self, pool: ImagePool, max_inflight: int = 2, size: tuple[int, int] = (1024, 1024)):
+        self.pool = pool
+        self.max_inflight = max_inflight
+        self.size = size  # 直近に要求された画像サイズ
+        self.variant: tuple[str | None, str] = (None, "balanced")  # 直近に要求された (format, preset)
+        self.scheduled = 0
+        self.completed = 0
+        self.skipped = 0
+        self.errors = 0
+        self.used = 0
+        self.wasted = 0
+        self._inflight = 0
+        self._tasks: set[asyncio.Task] = set()
+        self._pending: dict[str, set[Item]] = {}  # player_id → まだ使われていない先読み
+
+    def _idle(self) -> bool:
+        return self._inflight < self.max_inflight and self.pool.idle_workers() > 0
+
+    def schedule(self, player_id: str, story_id: str, scene_id: str,
+                 scenes: Mapping[str, dict], images: Mapping[str, str]) -> None:
+        """Warm ``scene_id`` and its choice targets. Call from the event loop thread."""
+        if self.max_inflight <= 0:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # イベントループ外（スクリプトからの直接呼び出し）では先読みしない
+        # 到着したシーンの先読みはまだ使われる見込みがあるので引き継ぎ、それ以外は外れとして数える
+        old = self._pending.pop(player_id, set())
+        pending = self._pending[player_id] = {item for item in old if item[1:3] == (story_id, scene_id)}
+        self.wasted += len(old) - len(pending)
+        scene = scenes.get(scene_id) or {}
+        targets = dict.fromkeys([scene_id] + [c.get("next") for c in scene.get("choices") or []])
+        width, height = self.size
+        fmt, preset = self.variant
+        for target in targets:
+            if target not in scenes:
+                continue
+            if isinstance(scenes, LazyScenes) and not scenes.is_loaded(target):
+                self._start(loop, pending, ("scene", story_id, target), lambda t=target: asyncio.to_thread(scenes.get, t))
+            image_path = images.get(target)
+            if image_path:
+                item = ("image", story_id, target, width, height, fmt, preset)
+                self._start(loop, pending, item, lambda p=image_path: self.pool.render(p, width, height, fmt, preset))
+
+    def _start(self, loop: asyncio.AbstractEventLoop, pending: set[Item], item: Item,
+               work: Callable[[], Awaitable]) -> None:
+        if item in pending:
+            return
+        if not self._idle():
+            self.skipped += 1  # 予算超過: 待たせずに捨てる
+            return
+        self._inflight += 1
+        self.scheduled += 1
+        pending.add(item)
+        task = loop.create_task(self._run(work()))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, work: Awaitable) -> None:
+        try:
+            await work
+            self.completed += 1
+        except Exception as e:  # 先読みの失敗は本番の要求で改めて報告される
+            self.errors += 1
+            logger.warning("Prefetch failed: %s", e)
+        finally:
+            self._inflight -= 1
+
+    def _use(self, player_id: str, item: Item) -> None:
+        pending = self._pending.get(player_id)
+        if pending and item in pending:
+            pending.discard(item)
+            self.used += 1
+
+    def note_image(self, player_id: str, story_id: str, scene_id: str, width: int, height: int,
+                   format: str | None = None, preset: str = "balanced") -> None:
+        """Record a load_scene_image request (and remember its size and format for later prefetches)."""
+        self.size = (width, height)
+        self.variant = (format, preset)
+        self._use(player_id, ("image", story_id, scene_id, width, height, format, preset))
+
+    def note_scene(self, player_id: str, story_id: str, scene_id: str) -> None:
+        """Record that the player moved to ``scene_id`` (its document is about to be served)."""
+        self._use(player_id, ("scene", story_id, scene_id))
+
+    def stats(self) -> dict:
+        resolved = self.used + self.wasted
+        return {
+            "scheduled": self.scheduled,
+            "completed": self.completed,
+            "skipped": self.skipped,
+            "errors": self.errors,
+            "inflight": self._inflight,
+            "used": self.used,
+            "wasted": self.wasted,
+            "hit_rate": round(self.used / resolved, 3) if resolved else None,
+        }
+
+
+def from_env(pool: ImagePool) -> Prefetcher:
+    """Build the prefetcher from NOVEL_PREFETCH / NOVEL_PREFETCH_INFLIGHT (max_inflight=0 when disabled)."""
+    enabled = os.environ.get("NOVEL_PREFETCH", "1") != "0"
+    return Prefetcher(pool, max_inflight=int(os.environ.get("NOVEL_PREFETCH_INFLIGHT", 2)) if enabled else 0)
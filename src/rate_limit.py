@@ -0,0 +1,223 @@
+"""Per-player rate limiting and admission control. Both are off unless configured.
+
+:func:`install` wraps every tool / resource registered afterwards so that each
+call is charged to a token bucket before it runs. There is one bucket per
+(``player_id``, tool), so a player who keeps requesting images still gets to
+``choose``. Calls without a player_id (catalog and scene reads, resources) are
+not limited per caller: a shared bucket would cap the busiest read paths of
+every client at one player's allowance. They are only subject to shedding. A
+call that finds its bucket empty is rejected with :class:`RateLimited`, which
+tells the client how long to wait.
+
+Tools cost different amounts: an image encode costs more than ``get_scene``,
+and calls with ``max_width`` / ``max_height`` are scaled by the requested area
+relative to 1024x1024. Calls inside ``batch`` are charged one by one.
+
+Load shedding looks at the actual backlog instead of a request rate: when the
+image pool has NOVEL_RATE_SHED_QUEUE or more encodes waiting or running, new
+image requests (:data:`SHED_TOOLS`) are rejected before they queue up, while
+cheap reads keep being served.
+
+Configuration (environment):
+    NOVEL_RATE_LIMIT       tokens per second per player and tool (default: 0 = no limit)
+    NOVEL_RATE_BURST       bucket size (default: 3 x NOVEL_RATE_LIMIT)
+    NOVEL_RATE_SHED_QUEUE  image pool backlog at which image requests are shed (default: 0 = never)
+    NOVEL_RATE_COSTS       per-tool cost overrides, e.g. "load_scene_image=20,search_scenes=3"
+"""
+
+from collections import Counter, OrderedDict
+from collections.abc import Callable
+import functools
+import inspect
+import math
+import os
+import threading
+import time
+
+DEFAULT_COSTS = {
+    "load_scene_image": 10.0,  # 1024x1024 の場合; 面積に比例
+    "get_scene_image_original": 3.0,
+    "export_story_log": 5.0,
+    "search_scenes": 2.0,
+    "play_turn": 2.0,
+}
+SHED_TOOLS = frozenset({"load_scene_image"})  # 画像プールに仕事を積むツール
+SHED_RETRY_AFTER = 1.0
+MAX_BUCKETS = 10000  # これを超えたら最も長く使われていないバケットを捨てる
+_REFERENCE_AREA = 1024 * 1024
+
+
+class RateLimited(RuntimeError):
+    """Raised when a caller is over its rate limit. Safe to retry after ``retry_after`` seconds."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, cost: float) -> float:
+        """Seconds until ``cost`` tokens are available (0 if they are now), rounded up to 0.1s.
+
+        A cost above ``burst`` only needs a full bucket (the bucket then goes negative).
+        """
+        missing = min(cost, self.burst) - self.tokens
+        return math.ceil(missing / self.rate * 10) / 10 if missing > 0 else 0.0
+
+
+class RateLimiter:
+    def __init__(self, rate: float = 0.0, burst: float | None = None, costs: dict[str, float] | None = None,
+                 backlog: Callable[[], int] | None = None, shed_queue: int = 0):
+        self.rate = rate
+        self.burst = burst if burst is not None else 3 * rate
+        self.costs = {**DEFAULT_COSTS, **(costs or {})}
+        self.backlog = backlog  # 画像プールの待ち + 実行中の数（image_pool.ImagePool.backlog）
+        self.shed_queue = shed_queue
+        self._buckets: OrderedDict[tuple[str, str], TokenBucket] = OrderedDict()  # LRU
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.throttled: Counter[str] = Counter()  # tool → 拒否数（プレイヤー単位の上限）
+        self.shed: Counter[str] = Counter()  # tool → 拒否数（画像プールの混雑）
+
+    def cost(self, tool: str, args: dict) -> float:
+        cost = self.costs.get(tool, 1.0)
+        if "max_width" in args or "max_height" in args:
+            area = int(args.get("max_width", 1024)) * int(args.get("max_height", 1024))
+            cost *= max(0.25, area / _REFERENCE_AREA)
+        return cost
+
+    def _bucket(self, key: tuple[str, str], now: float) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            while len(self._buckets) >= MAX_BUCKETS:
+                self._buckets.popitem(last=False)
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst, now)
+        else:
+            self._buckets.move_to_end(key)
+            bucket.refill(now)
+        return bucket
+
+    def charge(self, tool: str, args: dict) -> None:
+        """Shed the call if the image pool is backed up, then take its cost from the player's bucket."""
+        if self.shed_queue > 0 and self.backlog is not None and tool in SHED_TOOLS:
+            queued = self.backlog()
+            if queued >= self.shed_queue:
+                with self._lock:
+                    self.shed[tool] += 1
+                raise RateLimited(
+                    f"Server is overloaded ({queued} image requests queued, {tool} rejected). "
+                    f"Retry after {SHED_RETRY_AFTER:.1f}s.", SHED_RETRY_AFTER
+                )
+        player_id = args.get("player_id")
+        if self.rate <= 0 or player_id is None:
+            return
+        cost = self.cost(tool, args)
+        with self._lock:
+            bucket = self._bucket((str(player_id), tool), time.monotonic())
+            wait = bucket.wait_time(cost)
+            if wait > 0:
+                self.throttled[tool] += 1
+                raise RateLimited(
+                    f"Rate limit exceeded for player {player_id} ({tool} costs {cost:g} tokens, "
+                    f"{self.rate:g}/s per player and tool). Retry after {wait:.1f}s.", wait
+                )
+            bucket.tokens -= cost
+            self.allowed += 1
+
+    def wrap(self, name: str, fn: Callable) -> Callable:
+        signature = inspect.signature(fn)
+
+        def arguments(args, kwargs) -> dict:
+            if not args:
+                return kwargs
+            return signature.bind_partial(*args, **kwargs).arguments
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def limited(*args, **kwargs):
+                self.charge(name, arguments(args, kwargs))
+                return await fn(*args, **kwargs)
+        else:
+            @functools.wraps(fn)
+            def limited(*args, **kwargs):
+                self.charge(name, arguments(args, kwargs))
+                return fn(*args, **kwargs)
+        return limited
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "rate": self.rate,
+                "burst": self.burst,
+                "shed_queue": self.shed_queue,
+                "buckets": len(self._buckets),
+                "allowed": self.allowed,
+                "throttled": sum(self.throttled.values()),
+                "shed": sum(self.shed.values()),
+                **{f"throttled_{tool}": n for tool, n in self.throttled.items()},
+                **{f"shed_{tool}": n for tool, n in self.shed.items()},
+            }
+
+
+def install(mcp, limiter: RateLimiter) -> None:
+    """Charge every function registered through ``mcp.tool()`` / ``mcp.resource()`` from now on.
+
+    Call after metrics.instrument so that rejected calls are counted as errors.
+    """
+    tool, resource = mcp.tool, mcp.resource
+
+    def tool_decorator(*args, **kwargs):
+        register = tool(*args, **kwargs)
+
+        def decorator(fn):
+            register(limiter.wrap(kwargs.get("name") or fn.__name__, fn))
+            return fn  # 直接呼び出し（batch など）は呼び出し側で charge する
+
+        return decorator
+
+    def resource_decorator(uri: str, **kwargs):
+        register = resource(uri, **kwargs)
+
+        def decorator(fn):
+            register(limiter.wrap(kwargs.get("name") or fn.__name__, fn))
+            return fn
+
+        return decorator
+
+    mcp.tool = tool_decorator
+    mcp.resource = resource_decorator
+
+
+def _parse_costs(spec: str) -> dict[str, float]:
+    costs = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        tool, _, value = item.partition("=")
+        costs[tool.strip()] = float(value)
+    return costs
+
+
+def from_env(backlog: Callable[[], int] | None = None) -> RateLimiter:
+    """Build the limiter from NOVEL_RATE_LIMIT / NOVEL_RATE_BURST / NOVEL_RATE_SHED_QUEUE / NOVEL_RATE_COSTS.
+
+    ``backlog`` reports the image pool's queue depth (used for shedding).
+    """
+    burst = os.environ.get("NOVEL_RATE_BURST")
+    return RateLimiter(
+        rate=float(os.environ.get("NOVEL_RATE_LIMIT", 0)),
+        burst=float(burst) if burst else None,
+        costs=_parse_costs(os.environ.get("NOVEL_RATE_COSTS", "")),
+        backlog=backlog,
+        shed_queue=int(os.environ.get("NOVEL_RATE_SHED_QUEUE", 0)),
+    )
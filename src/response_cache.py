@@ -0,0 +1,142 @@
+"""Pre-serialized responses for the read-only story endpoints.
+
+``list_stories`` / ``get_story_meta`` / ``list_story_images`` / ``get_scene``
+and their ``novelgame://`` resources return the same data until the story is
+reloaded. :class:`ResponseCache` serializes each response once, with the same
+``json.dumps(to_jsonable_python(...))`` fastmcp uses (so clients see identical
+text), and keeps it until :meth:`ResponseCache.invalidate` is called from
+RELOAD_HOOKS. Only the JSON text and its ETag are kept (not the data it was
+built from), and the cache is bounded by entry count and by the total size of
+that text, evicting least recently used entries first.
+
+Every entry carries an ETag (hash of its JSON, so it is stable across restarts
+and workers). Callers that pass ``if_none_match`` get an envelope
+``{"etag", "not_modified", "data"}``; ``data`` is left out when the ETag still
+matches. Per-story version tokens change on every reload of that story.
+
+Configuration (environment):
+    NOVEL_RESPONSE_CACHE        max cached responses (default: 4096, 0 disables)
+    NOVEL_RESPONSE_CACHE_BYTES  max total size of the cached JSON (default: 32MB)
+"""
+
+from collections import OrderedDict
+from collections.abc import Callable
+from dataclasses import dataclass
+import hashlib
+import json
+import os
+import threading
+import time
+
+import pydantic_core
+
+Key = tuple[str, str | None, str | None]  # (endpoint, story_id or None=catalog, scene_id or None)
+
+
+class CachedJSON(str):
+    """JSON text for fastmcp to send as is; ``value`` decodes it again for direct callers (batch)."""
+
+    @property
+    def value(self):
+        return json.loads(self)
+
+
+@dataclass(frozen=True, slots=True)
+class Entry:
+    json: str  # ensure_ascii なので len() がそのままバイト数
+    etag: str
+
+
+def serialize(value) -> Entry:
+    text = json.dumps(pydantic_core.to_jsonable_python(value))  # fastmcp と同じ形式
+    return Entry(text, hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest())
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = 4096, max_bytes: int = 32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.epoch = f"{int(time.time()):x}"  # バージョン番号は再起動で振り直しになるので区別する
+        self._entries: OrderedDict[Key, Entry] = OrderedDict()
+        self._bytes = 0
+        self._versions: dict[str, int] = {}
+        self._generation = 0  # invalidate ごとに増える; 構築中に無効化されたエントリは保存しない
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.evictions = 0
+
+    def entry(self, key: Key, build: Callable[[], object]) -> Entry:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+            generation = self._generation
+        value = build()
+        entry = serialize(value)
+        # 空の応答（存在しないストーリー / シーン）は作り直しても安いので保存しない
+        if self.max_entries > 0 and value and len(entry.json) <= self.max_bytes:
+            with self._lock:
+                if generation == self._generation:
+                    old = self._entries.pop(key, None)
+                    if old is not None:
+                        self._bytes -= len(old.json)
+                    self._entries[key] = entry
+                    self._bytes += len(entry.json)
+                    while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                        _, evicted = self._entries.popitem(last=False)
+                        self._bytes -= len(evicted.json)
+                        self.evictions += 1
+        return entry
+
+    def respond(self, key: Key, build: Callable[[], object], if_none_match: str | None = None) -> CachedJSON:
+        """The cached JSON, or the conditional envelope when ``if_none_match`` is given."""
+        entry = self.entry(key, build)
+        if if_none_match is None:
+            return CachedJSON(entry.json)
+        if if_none_match == entry.etag:
+            with self._lock:
+                self.not_modified += 1
+            return CachedJSON(json.dumps({"etag": entry.etag, "not_modified": True}))
+        return CachedJSON(f'{{"etag": "{entry.etag}", "not_modified": false, "data": {entry.json}}}')
+
+    def invalidate(self, story_id: str, scenes: frozenset[str] | None = None) -> None:
+        """Drop the story's entries (only the changed scenes if given) and the catalog-wide ones."""
+        with self._lock:
+            self._generation += 1
+            self._versions[story_id] = self._versions.get(story_id, 0) + 1
+            stale = [
+                key for key in self._entries
+                if key[1] is None or (key[1] == story_id and (scenes is None or key[2] is None or key[2] in scenes))
+            ]
+            for key in stale:
+                self._bytes -= len(self._entries.pop(key).json)
+
+    def version(self, story_id: str) -> str:
+        """Token that changes whenever the story is reloaded."""
+        return f"{self.epoch}.{self._versions.get(story_id, 0)}"
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "not_modified": self.not_modified,
+                "evictions": self.evictions,
+            }
+
+
+def from_env() -> ResponseCache:
+    """Build the cache from NOVEL_RESPONSE_CACHE / NOVEL_RESPONSE_CACHE_BYTES."""
+    return ResponseCache(
+        max_entries=int(os.environ.get("NOVEL_RESPONSE_CACHE", 4096)),
+        max_bytes=int(os.environ.get("NOVEL_RESPONSE_CACHE_BYTES", 32 * 1024 * 1024)),
+    )
@@ -0,0 +1,140 @@
+"""Lazy scene documents backed by a bounded LRU cache.
+
+With ``NOVEL_LAZY_SCENES=1`` the servers start from meta.yaml plus a scene-id
+index only, and ``SCENES[story_id]`` becomes a :class:`LazyScenes` mapping
+that parses a scene document on first access. Parsed documents live in one
+process-wide :class:`SceneCache` bounded by entry count and (approximate,
+pickled) size.
+
+Configuration (environment):
+    NOVEL_LAZY_SCENES          "1" to enable lazy loading (default: eager)
+    NOVEL_SCENE_CACHE_ENTRIES  max cached scene documents (default: 1024)
+    NOVEL_SCENE_CACHE_BYTES    max approximate bytes of cached documents (default: 64MB)
+"""
+
+from collections import OrderedDict
+from collections.abc import Callable, Iterable, Iterator, Mapping
+import logging
+import os
+import pickle
+import threading
+
+logger = logging.getLogger("novelgame.scene_cache")
+
+
+class SceneCache:
+    """LRU of parsed scene documents keyed by (story_id, scene_id)."""
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._docs: OrderedDict[tuple[str, str], tuple[dict, int]] = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key: tuple[str, str]) -> dict | None:
+        with self._lock:
+            entry = self._docs.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._docs.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: tuple[str, str], doc: dict) -> None:
+        size = len(pickle.dumps(doc, pickle.HIGHEST_PROTOCOL))
+        with self._lock:
+            old = self._docs.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._docs[key] = (doc, size)
+            self._bytes += size
+            while self._docs and (len(self._docs) > self.max_entries or self._bytes > self.max_bytes):
+                _, (_, evicted) = self._docs.popitem(last=False)
+                self._bytes -= evicted
+                self.evictions += 1
+
+    def contains(self, key: tuple[str, str]) -> bool:
+        """Membership test that neither counts as a hit/miss nor refreshes the entry."""
+        with self._lock:
+            return key in self._docs
+
+    def invalidate(self, story_id: str, scene_id: str | None = None) -> None:
+        """Drop one scene, or every scene of ``story_id`` when ``scene_id`` is None."""
+        with self._lock:
+            keys = [(story_id, scene_id)] if scene_id is not None else [k for k in self._docs if k[0] == story_id]
+            for key in keys:
+                entry = self._docs.pop(key, None)
+                if entry is not None:
+                    self._bytes -= entry[1]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._docs),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class LazyScenes(Mapping[str, dict]):
+    """Read-only scene_id → document mapping that parses documents on first access."""
+
+    def __init__(self, story_id: str, scene_ids: Iterable[str], load: Callable[[str], dict], cache: SceneCache):
+        self.story_id = story_id
+        self._ids = dict.fromkeys(scene_ids)  # 挿入順を保つ集合
+        self._load = load
+        self._cache = cache
+
+    def __getitem__(self, scene_id: str) -> dict:
+        if scene_id not in self._ids:
+            raise KeyError(scene_id)
+        key = (self.story_id, scene_id)
+        doc = self._cache.get(key)
+        if doc is None:
+            doc = self._load(scene_id)
+            self._cache.put(key, doc)
+        return doc
+
+    def __contains__(self, scene_id: object) -> bool:
+        return scene_id in self._ids
+
+    def is_loaded(self, scene_id: str) -> bool:
+        return self._cache.contains((self.story_id, scene_id))
+
+    def documents(self) -> Iterator[tuple[str, dict]]:
+        """Parse every scene without going through the cache (for indexes built in the background).
+
+        Scenes that fail to parse are skipped; reading them through the mapping raises as usual.
+        """
+        for scene_id in list(self._ids):
+            try:
+                yield scene_id, self._load(scene_id)
+            except Exception as e:
+                logger.warning("Skipping scene %s/%s while indexing: %s", self.story_id, scene_id, e)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._ids)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+
+def lazy_enabled() -> bool:
+    return os.environ.get("NOVEL_LAZY_SCENES", "0") == "1"
+
+
+def from_env() -> SceneCache:
+    """Build the cache from NOVEL_SCENE_CACHE_ENTRIES / NOVEL_SCENE_CACHE_BYTES."""
+    return SceneCache(
+        max_entries=int(os.environ.get("NOVEL_SCENE_CACHE_ENTRIES", 1024)),
+        max_bytes=int(os.environ.get("NOVEL_SCENE_CACHE_BYTES", 64 * 1024 * 1024)),
+    )
@@ -0,0 +1,216 @@
+"""In-memory full-text index over scene bodies, choice texts and story metadata.
+
+Text is NFKC-normalized and case-folded. Runs of Japanese / Chinese / Korean
+characters are indexed as character bigrams plus unigrams, everything else
+as words, so "魔法使い" also matches "魔法使いの弟子" and a one-character query
+such as "鍵" still finds something, without a dictionary. A query matches documents containing all of its terms
+(falling back to any term when nothing matches) and is ranked with BM25 over
+weighted fields: choice texts and metadata count more than body text.
+
+Documents are ``(story_id, scene_id)`` for scenes and ``(story_id, None)`` for
+a story's ``meta.yaml``. Stories are added as they load and updated per changed
+scene on reload (see ``add`` / ``drop``). Lazily loaded stories are indexed from
+documents streamed past the scene cache (``add_documents``).
+"""
+
+from collections import Counter
+from collections.abc import Callable, Iterable, Mapping
+import math
+import re
+import threading
+import unicodedata
+
+MAX_RESULTS = 50
+FIELD_WEIGHTS = {"body": 1.0, "choices": 1.5, "meta": 2.0}
+K1, B = 1.2, 0.75  # BM25
+SNIPPET_CHARS = 80
+
+# 々, ひらがな・カタカナ, CJK 統合漢字（拡張 A・互換を含む）, ハングル
+_CJK = "\u3005\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af"
+_TOKEN = re.compile(rf"(?P<cjk>[{_CJK}]+)|[^\W_{_CJK}]+")
+
+DocKey = tuple[str, str | None]
+
+
+def tokenize(text: str, unigrams: bool = False) -> list[str]:
+    """Words for alphabetic scripts, character bigrams for CJK runs.
+
+    With ``unigrams`` (documents) every CJK character is emitted as well; queries
+    only fall back to a unigram for a one-character run.
+    """
+    tokens = []
+    for match in _TOKEN.finditer(unicodedata.normalize("NFKC", text).casefold()):
+        run = match.group()
+        if match.lastgroup == "cjk":
+            if unigrams and len(run) > 1:
+                tokens.extend(run)
+            tokens.extend([run] if len(run) == 1 else [run[i:i + 2] for i in range(len(run) - 1)])
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def _meta_text(value) -> str:
+    if isinstance(value, dict):
+        return " ".join(_meta_text(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return " ".join(_meta_text(v) for v in value)
+    return value if isinstance(value, str) else ""
+
+
+def scene_fields(scene: dict) -> dict[str, str]:
+    return {
+        "body": scene.get("body_md") or "",
+        "choices": " ".join(c.get("text") or "" for c in scene.get("choices") or []),
+    }
+
+
+def snippet(text: str, terms: list[str], width: int = SNIPPET_CHARS) -> str:
+    """About ``width`` characters of ``text`` around the first query term."""
+    flat = " ".join(text.split())
+    folded = flat.casefold()
+    hits = [i for i in (folded.find(t) for t in terms) if i >= 0]
+    start = max(0, min(hits) - width // 4) if hits else 0
+    end = start + width
+    return ("…" if start else "") + flat[start:end] + ("…" if end < len(flat) else "")
+
+
+class SearchIndex:
+    def __init__(self, lookup: Callable[[str, str | None], dict]):
+        self.lookup = lookup  # (story_id, scene_id or None=meta) → document, for snippets
+        self._postings: dict[str, dict[DocKey, float]] = {}  # term → doc → weighted tf
+        self._docs: dict[DocKey, tuple[float, frozenset[str]]] = {}  # doc → (weighted length, terms)
+        self._stories: dict[str, set[DocKey]] = {}
+        self._total_length = 0.0
+        self._lock = threading.Lock()
+        self.searches = 0
+
+    def has_story(self, story_id: str) -> bool:
+        return story_id in self._stories
+
+    def _add_doc(self, key: DocKey, fields: dict[str, str]) -> None:
+        tf: Counter[str] = Counter()
+        for field, text in fields.items():
+            weight = FIELD_WEIGHTS[field]
+            for token in tokenize(text, unigrams=True):
+                tf[token] += weight
+        length = sum(tf.values())
+        self._docs[key] = (length, frozenset(tf))
+        self._total_length += length
+        self._stories.setdefault(key[0], set()).add(key)
+        for term, n in tf.items():
+            self._postings.setdefault(term, {})[key] = n
+
+    def _drop_doc(self, key: DocKey) -> None:
+        entry = self._docs.pop(key, None)
+        if entry is None:
+            return
+        length, terms = entry
+        self._total_length -= length
+        for term in terms:
+            postings = self._postings[term]
+            del postings[key]
+            if not postings:
+                del self._postings[term]
+        self._stories[key[0]].discard(key)
+
+    def add(self, story_id: str, meta: dict | None, scenes: Mapping[str, dict],
+            scene_ids: Iterable[str] | None = None) -> None:
+        """Index the story's meta (unless None) and ``scene_ids`` (default: every scene)."""
+        ids = scenes if scene_ids is None else [scene_id for scene_id in scene_ids if scene_id in scenes]
+        self.add_documents(story_id, meta, ((scene_id, scenes[scene_id]) for scene_id in ids))
+
+    def add_documents(self, story_id: str, meta: dict | None, documents: Iterable[tuple[str, dict]]) -> None:
+        """Index the story's meta (unless None) and ``(scene_id, document)`` pairs, e.g. LazyScenes.documents()."""
+        # シーン本体の読み込み（lazy モード）はロックの外で行い、索引には抜き出したテキストだけを残す
+        docs = []
+        if meta is not None:
+            docs.append(((story_id, None), {"meta": _meta_text(meta)}))
+        for scene_id, doc in documents:
+            docs.append(((story_id, scene_id), scene_fields(doc)))
+        with self._lock:
+            self._stories.setdefault(story_id, set())
+            for key, fields in docs:
+                self._drop_doc(key)
+                self._add_doc(key, fields)
+
+    def drop(self, story_id: str, scene_ids: Iterable[str] | None = None) -> None:
+        """Remove ``scene_ids`` of the story, or the whole story (meta included) when None."""
+        with self._lock:
+            if scene_ids is None:
+                for key in list(self._stories.get(story_id, ())):
+                    self._drop_doc(key)
+                self._stories.pop(story_id, None)
+            else:
+                for scene_id in scene_ids:
+                    self._drop_doc((story_id, scene_id))
+
+    def _rank(self, terms: list[str], story_id: str | None, require_all: bool) -> list[tuple[float, DocKey]]:
+        postings = sorted((self._postings.get(t, {}) for t in dict.fromkeys(terms)), key=len)
+        if require_all:
+            if not postings or not postings[0]:
+                return []
+            candidates = set(postings[0]).intersection(*postings[1:])
+        else:
+            candidates = set().union(*postings)
+        if story_id is not None:
+            candidates = {key for key in candidates if key[0] == story_id}
+        n = len(self._docs)
+        avg_length = self._total_length / n if n else 0.0
+        scored = []
+        for key in candidates:
+            length = self._docs[key][0]
+            score = 0.0
+            for p in postings:
+                tf = p.get(key)
+                if tf:
+                    idf = math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5))
+                    score += idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / avg_length))
+            scored.append((score, key))
+        scored.sort(key=lambda item: (-item[0], item[1][0], item[1][1] or ""))
+        return scored
+
+    def search(self, query: str, story_id: str | None = None, cursor: str | None = None, limit: int = 10) -> dict:
+        """One page of ranked hits: ``{"query", "match", "total", "results": [...], "next_cursor"}``.
+
+        ``match`` is "all" when every term matched, "any" for the fallback.
+        Pass ``next_cursor`` back as ``cursor`` for the following page.
+        """
+        limit = max(1, min(limit, MAX_RESULTS))
+        offset = int(cursor) if cursor else 0
+        terms = tokenize(query)
+        with self._lock:
+            self.searches += 1
+            match = "all"
+            ranked = self._rank(terms, story_id, True) if terms else []
+            if not ranked and terms:
+                match, ranked = "any", self._rank(terms, story_id, False)
+            page = ranked[offset:offset + limit]
+        results = []
+        for score, (sid, scene_id) in page:
+            doc = self.lookup(sid, scene_id) or {}
+            fields = {"meta": _meta_text(doc)} if scene_id is None else scene_fields(doc)
+            matched = [f for f, text in fields.items() if set(tokenize(text, unigrams=True)).intersection(terms)]
+            results.append({
+                "story_id": sid,
+                "scene_id": scene_id,
+                "score": round(score, 3),
+                "fields": matched,
+                "snippet": snippet(fields.get("body") or " ".join(fields.values()), terms),
+            })
+        return {
+            "query": query,
+            "match": match,
+            "total": len(ranked),
+            "results": results,
+            "next_cursor": str(offset + limit) if offset + limit < len(ranked) else None,
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "stories": len(self._stories),
+                "documents": len(self._docs),
+                "terms": len(self._postings),
+                "searches": self.searches,
+            }
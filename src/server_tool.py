@@ -1,70 +1,77 @@
+import asyncio
 from collections import defaultdict
+from collections.abc import Callable, Mapping
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timezone
 import glob
+import inspect
+import logging
 import pathlib
-import yaml
 import os
 
 from fastmcp import FastMCP, Image
-from PIL import Image as PILImage
-import io
+
+import event_log
+import image_cache
+import image_chunks
+import image_pool
+import imaging
+import metrics
+import prefetch
+import rate_limit
+import response_cache
+import scene_cache
+import search_index
+import session_store
+import story_graph
+import story_loader
+import story_watcher
+import workers
+
+metrics.configure_logging()  # stderr, NOVEL_LOGGING_LEVEL (see metrics.py)
+logger = logging.getLogger("novelgame.server_tool")
 
 ROOT = pathlib.Path(__file__).parent
-NOVEL_DIR = ROOT / "stories"  # src/stories/<STORY_ID>/<scene_id>.yaml
+NOVEL_DIR = pathlib.Path(os.environ.get("NOVEL_STORIES_DIR", ROOT / "stories"))  # src/stories/<STORY_ID>/<scene_id>.yaml
+IMAGE_CACHE = image_cache.from_env()  # resized image variants (see image_cache.py)
+IMAGE_POOL = image_pool.from_env(IMAGE_CACHE)  # off-loop encoder (see image_pool.py)
+PREFETCH = prefetch.from_env(IMAGE_POOL)  # warms the likely next scenes (see prefetch.py)
+SCENE_CACHE = scene_cache.from_env()  # parsed scenes in lazy mode (see scene_cache.py)
 
 
 mcp = FastMCP("NovelGame-MCP-Server")
+METRICS = metrics.from_env()  # per tool / resource calls, latency, payload (see metrics.py)
+metrics.instrument(mcp, METRICS)  # 以降の @mcp.tool() / @mcp.resource() はすべて計測される
+RATE_LIMITS = rate_limit.from_env(IMAGE_POOL.backlog)  # per-player token buckets and image-backlog shedding (see rate_limit.py)
+rate_limit.install(mcp, RATE_LIMITS)  # instrument の後: 拒否された呼び出しもエラーとして計測される
 
 # ---------------------------------------------------------------------------
 # 1) Load all stories (YAML → in‑mem)
 # ---------------------------------------------------------------------------
 META: dict[str, dict] = {}
-SCENES: dict[str, dict[str, dict]] = defaultdict(dict)
+SCENES: dict[str, Mapping[str, dict]] = defaultdict(dict)  # lazy mode: scene_cache.LazyScenes
 IMAGES: dict[str, dict[str, str]] = {}
 STATE: dict[str, dict] = {}
-
-# 全てのストーリーディレクトリを確認
-story_dirs = [p for p in NOVEL_DIR.glob("*") if p.is_dir()]
-# print(f"[DEBUG] ROOT={ROOT}, NOVEL_DIR={NOVEL_DIR}, story_dirs={[str(p) for p in story_dirs]}")
-for story_dir in story_dirs:
-    story_id = story_dir.name
-    
-    # メタデータの読み込み
-    meta_path = os.path.join(str(story_dir), "meta.yaml")
-    if os.path.exists(meta_path):
-        try:
-            with open(meta_path, "r", encoding="utf-8") as f:
-                META[story_id] = yaml.safe_load(f)
-        except Exception as e:
-            print(f"Error loading meta file for {story_id}: {e}")
-            META[story_id] = {"title": story_id}  # 最低限のメタデータ
-    else:
-        print(f"Warning: No meta.yaml found for {story_id}")
-        META[story_id] = {"title": story_id}  # メタファイルがない場合のフォールバック
-    
-    # シーンの読み込み
-    for scene_file in story_dir.glob("*.yaml"):
-        if scene_file.name == "meta.yaml":
-            continue
-        try:
-            with open(scene_file, "r", encoding="utf-8") as f:
-                doc = yaml.safe_load(f)
-            scene_id = doc.pop("id", scene_file.stem)  # ファイル名をフォールバックとして使用
-            SCENES.setdefault(story_id, {})[scene_id] = {"type": "preset", **doc}
-
-            # 画像ファイルの読み込み（PNG優先、なければJPG）
-            images_dir = os.path.join(str(story_dir), "images")
-            png_file = os.path.join(images_dir, f"{scene_id}.png")
-            jpg_file = os.path.join(images_dir, f"{scene_id}.jpg")
-            image_path = None
-            if os.path.exists(png_file):
-                image_path = png_file
-            elif os.path.exists(jpg_file):
-                image_path = jpg_file
-            if image_path:
-                IMAGES.setdefault(story_id, {})[scene_id] = os.path.abspath(image_path)
-        except Exception as e:
-            print(f"Error loading scene file {scene_file}: {e}")
+CHOICES: dict[str, dict[str, list[dict]]] = {}  # story_id → story_graph.choice_index（lazy + バンドルなしでは後から読む）
+
+# 全てのストーリーディレクトリを読み込み（最新のバンドルがあればそちらを使い、YAML は複数プロセスでパース）
+CATALOG_LOAD = story_loader.load_catalog(
+    NOVEL_DIR, story_loader.bundle_dir_from_env(), SCENE_CACHE if scene_cache.lazy_enabled() else None
+)
+STORIES = CATALOG_LOAD.stories
+logger.info(  # ストーリーごとの内訳とパースエラーは get_server_metrics の catalog_load
+    "Loaded %d stories in %.3fs (%d YAML workers, %d parse errors)",
+    len(STORIES), CATALOG_LOAD.seconds, CATALOG_LOAD.workers, sum(len(r.errors) for r in CATALOG_LOAD.report),
+)
+IMAGE_POOL.start()  # process モードのワーカーはスレッドを起動する前（ここ）で fork する
+for story in STORIES:
+    META[story.story_id] = story.meta
+    if story.scenes:
+        SCENES[story.story_id] = story.scenes
+    if story.images:
+        IMAGES[story.story_id] = story.images
+    if story.choices is not None:
+        CHOICES[story.story_id] = story.choices
 
 # 各ストーリーの初期状態を設定
 for story_id in META.keys():
@@ -73,67 +80,323 @@ for story_id in META.keys():
         if intro_scene:
             STATE[story_id] = {"scene_id": intro_scene, "flags": {}, "summary": ""}
         else:
-            print(f"Warning: No scenes found for {story_id}")
+            logger.warning("No scenes found for %s", story_id)
+    else:
+        logger.warning("META exists but no SCENES for %s", story_id)
+
+# 派生キャッシュの無効化フック: hook(story_id, 変更された scene_id 集合 or None=ストーリー全体)
+RELOAD_HOOKS: list[Callable[[str, frozenset[str] | None], None]] = []
+
+
+def apply_story_change(change: story_watcher.StoryChange) -> None:
+    """Swap a reloaded story into META / SCENES / IMAGES / STATE (called by the watcher thread)."""
+    story_id = change.story_id
+    if change.story is None:
+        for table in (META, SCENES, IMAGES, STATE):
+            table.pop(story_id, None)
     else:
-        print(f"Warning: META exists but no SCENES for {story_id}")
+        story = change.story
+        META[story_id] = story.meta
+        SCENES[story_id] = story.scenes
+        if story.images:
+            IMAGES[story_id] = story.images
+        else:
+            IMAGES.pop(story_id, None)
+        if story_id in STATE and STATE[story_id]["scene_id"] not in story.scenes:
+            del STATE[story_id]  # 開始シーンが消えた場合は作り直す
+        if story_id not in STATE and story.scenes:
+            intro_scene = "intro" if "intro" in story.scenes else sorted(story.scenes.keys())[0]
+            STATE[story_id] = {"scene_id": intro_scene, "flags": {}, "summary": ""}
+    for hook in RELOAD_HOOKS:
+        hook(story_id, change.scenes)
+
+
+GRAPHS: dict[str, story_graph.StoryGraph] = {}  # story_id → 選択肢の遷移グラフ（lazy モードでは初回参照時に構築）
+# lazy モードで選択肢索引がない（バンドルなしの索引 / リロード後の）ストーリーはループ外で読む
+INDEX_BUILDS = ThreadPoolExecutor(max_workers=1, thread_name_prefix="story-index")
+_CHOICE_BUILDS: dict[str, Future] = {}
+
+
+def _read_choices(story_id: str, scenes) -> None:
+    # LazyScenes はシーンキャッシュを経由せずに読む（リロードと競合した場合は普通の dict のこともある）
+    documents = scenes.documents() if isinstance(scenes, scene_cache.LazyScenes) else scenes.items()
+    choices = story_graph.choice_index(documents)
+    if SCENES.get(story_id) is scenes:  # 読んでいる間にリロードされていなければ
+        CHOICES[story_id] = choices
+
+
+def _choices_future(story_id: str) -> Future:
+    future = _CHOICE_BUILDS.get(story_id)
+    if future is None or (future.done() and future.exception() is not None):  # 失敗したら読み直す
+        future = _CHOICE_BUILDS[story_id] = INDEX_BUILDS.submit(_read_choices, story_id, SCENES.get(story_id, {}))
+    return future
+
+
+def graph_for(story_id: str) -> story_graph.StoryGraph | None:
+    """Branching graph of the story, built on first use and dropped when the story is reloaded.
+
+    None while a lazily loaded story's choice index is still being read in the background.
+    """
+    graph = GRAPHS.get(story_id)
+    if graph is None:
+        choices = CHOICES.get(story_id)
+        if choices is None:
+            _choices_future(story_id)
+            return None
+        graph = GRAPHS[story_id] = _build_graph(story_id, choices)
+    return graph
+
 
-# デバッグ用に読み込まれたデータを表示
-print(f"Loaded META: {list(META.keys())}")
-print(f"Loaded SCENES: {[(k, list(v.keys())) for k, v in SCENES.items()]}")
-print(f"Initialized STATE: {list(STATE.keys())}")
+def _build_graph(story_id: str, choices: dict[str, list[dict]]) -> story_graph.StoryGraph:
+    return story_graph.StoryGraph(story_id, choices, STATE.get(story_id, {}).get("scene_id", "intro"))
+
+
+async def graph_ready(story_id: str) -> story_graph.StoryGraph:
+    """graph_for, waiting (off the event loop) for the choice index if it is still being read."""
+    while (graph := graph_for(story_id)) is None:
+        await asyncio.wrap_future(_choices_future(story_id))
+    return graph
+
+
+def _reload_graph(story_id: str, scenes: frozenset[str] | None) -> None:
+    if story_id in STATE and not scene_cache.lazy_enabled():
+        # 新しい索引とグラフを作ってから差し替える: 途中の choose は古いグラフを見るだけで済む
+        choices = story_graph.choice_index(SCENES[story_id].items())
+        GRAPHS[story_id] = _build_graph(story_id, choices)
+        CHOICES[story_id] = choices
+        _CHOICE_BUILDS.pop(story_id, None)
+        return
+    GRAPHS.pop(story_id, None)
+    CHOICES.pop(story_id, None)
+    _CHOICE_BUILDS.pop(story_id, None)
+
+
+RELOAD_HOOKS.append(_reload_graph)
+if not scene_cache.lazy_enabled():
+    for story_id in STATE:
+        graph_for(story_id)
+
+RESPONSES = response_cache.from_env()  # pre-serialized read-only responses with ETags (see response_cache.py)
+RELOAD_HOOKS.append(RESPONSES.invalidate)
+
+# 本文・選択肢・meta.yaml の全文検索索引（lazy モードでは初回検索時に INDEX_BUILDS で構築）
+SEARCH = search_index.SearchIndex(
+    lambda story_id, scene_id: META.get(story_id, {}) if scene_id is None else SCENES.get(story_id, {}).get(scene_id, {})
+)
+_SEARCH_BUILDS: dict[str, Future] = {}
+
+
+def _read_search(story_id: str, scenes) -> None:
+    SEARCH.drop(story_id)
+    SEARCH.add_documents(story_id, META.get(story_id), scenes.documents() if scenes else ())  # シーンキャッシュを経由しない
+    if SCENES.get(story_id) is not scenes:  # 読んでいる間に削除 / リロードされた（後者は次のビルドが作り直す）
+        SEARCH.drop(story_id)
+
+
+def _search_future(story_id: str) -> Future:
+    future = _SEARCH_BUILDS.get(story_id)
+    if future is None:
+        future = _SEARCH_BUILDS[story_id] = INDEX_BUILDS.submit(_read_search, story_id, SCENES.get(story_id))
+    return future
+
+
+def _reload_search(story_id: str, scenes: frozenset[str] | None) -> None:
+    if scene_cache.lazy_enabled():
+        # 索引済み（または索引中）のストーリーだけをループ外で読み直す
+        indexed = _SEARCH_BUILDS.pop(story_id, None) is not None
+        SEARCH.drop(story_id)
+        if indexed and story_id in META:
+            _search_future(story_id)
+        return
+    SEARCH.drop(story_id, scenes)
+    if story_id in META:
+        SEARCH.add(story_id, META[story_id] if scenes is None else None, SCENES.get(story_id, {}), scenes)
+
+
+RELOAD_HOOKS.append(_reload_search)
+if not scene_cache.lazy_enabled():
+    for story_id in META:
+        SEARCH.add(story_id, META[story_id], SCENES.get(story_id, {}))
+
+
+STORY_WATCHER = None
+if story_watcher.watch_enabled():
+    STORY_WATCHER = story_watcher.StoryWatcher(
+        NOVEL_DIR, STORIES, apply_story_change, story_watcher.watch_interval(),
+        SCENE_CACHE if scene_cache.lazy_enabled() else None,
+    ).start()
+
+logger.info("Loaded %d stories: %s", len(META), list(META.keys()))
+if logger.isEnabledFor(logging.DEBUG):  # シーン一覧は大きいので DEBUG のときだけ組み立てる
+    logger.debug("Loaded SCENES: %s", [(k, list(v.keys())) for k, v in SCENES.items()])
+    logger.debug("Initialized STATE: %s", list(STATE.keys()))
 
 # ---------------------------------------------------------------------------
 # 2) Per‑player context
 # ---------------------------------------------------------------------------
-PLAYER_PATH: dict[str, list[str]] = defaultdict(list)  # player_id → visited scene list
-CURRENT_STORY: dict[str, str] = {}  # player_id → current story_id
-LOG: dict[str, list[dict]] = defaultdict(list)  # story_id → event list
+SESSIONS = session_store.from_env()  # player_id → current story_id + per-story PlayerState (persistent)
+LOG = event_log.from_env()  # story_id → event list (persistent, see event_log.py)
+
+for source, stats in (
+    ("image_cache", IMAGE_CACHE.stats), ("image_pool", IMAGE_POOL.stats), ("image_encode", imaging.encode_stats),
+    ("scene_cache", SCENE_CACHE.stats), ("prefetch", PREFETCH.stats), ("sessions", SESSIONS.stats), ("event_log", LOG.stats),
+    ("responses", RESPONSES.stats), ("search", SEARCH.stats), ("catalog_load", CATALOG_LOAD.stats),
+    ("rate_limit", RATE_LIMITS.stats),
+):
+    METRICS.add_source(source, stats)
+METRICS.add_histogram("image_encode_seconds", IMAGE_POOL.encode_seconds, "Image encode time (variant cache misses only).")
 
 now_ts = lambda: datetime.now(timezone.utc).isoformat()
 
+
+def initial_state(story_id: str) -> dict:
+    """The story's starting state in the same shape as PlayerState.to_dict ({} for an unknown story)."""
+    state = STATE.get(story_id)
+    return {**state, "path": []} if state is not None else {}
+
+
 # ---------------------------------------------------------------------------
 # 3) MCP Resources -> Tools
 # ---------------------------------------------------------------------------
 
 @mcp.tool()
-def list_stories() -> list[dict]:
-    """Return available stories with minimal metadata."""
-    return [{"story_id": sid, **META[sid]} for sid in META if SCENES[sid]]
+def list_stories(if_none_match: str | None = None) -> str:
+    """Return available stories with minimal metadata (JSON list).
+
+    With if_none_match (the etag of an earlier reply) the reply is {"etag", "not_modified", "data"};
+    data is omitted when the catalog has not changed.
+    """
+    return RESPONSES.respond(
+        ("list_stories", None, None), lambda: [{"story_id": sid, **META[sid]} for sid in META if SCENES[sid]], if_none_match
+    )
+
+
+@mcp.tool()
+def get_story_meta(story_id: str, if_none_match: str | None = None) -> str:
+    """Return metadata for a given story. Accepts if_none_match like list_stories."""
+    return RESPONSES.respond(("meta", story_id, None), lambda: META.get(story_id, {}), if_none_match)
+
+
+@mcp.tool()
+def get_story_state(story_id: str, player_id: str | None = None) -> dict:
+    """Return the player's state in the story (scene_id, flags, summary, path).
+
+    Without player_id (or before the player selected the story) returns the story's initial state.
+    """
+    if player_id is not None:
+        state = SESSIONS.state(player_id, story_id)
+        if state is not None:
+            return state.to_dict()
+    return initial_state(story_id)
+
+@mcp.tool()
+def list_story_images(story_id: str, if_none_match: str | None = None) -> str:
+    """Return list of available images for the specified story. Accepts if_none_match like list_stories."""
+    return RESPONSES.respond(("images", story_id, None), lambda: list(IMAGES.get(story_id, {}).keys()), if_none_match)
 
 
 @mcp.tool()
-def get_story_meta(story_id: str) -> dict:
-    """Return metadata for a given story."""
-    return META.get(story_id, {})
+def get_scene(story_id: str, scene_id: str, if_none_match: str | None = None) -> str:
+    """Return scene document (Markdown body + choices). Accepts if_none_match like list_stories."""
+    return RESPONSES.respond(
+        ("scene", story_id, scene_id), lambda: SCENES.get(story_id, {}).get(scene_id, {}), if_none_match
+    )
 
 
 @mcp.tool()
-def get_story_state(story_id: str) -> dict:
-    """Return global state (scene_id, flags, summary)."""
-    return STATE.get(story_id, {})
+async def get_story_graph(story_id: str) -> dict:
+    """Return the story's branching structure (choice edges, reverse edges, endings, unreachable scenes, dead ends, broken links)."""
+    if story_id not in SCENES or not SCENES[story_id]:
+        return {}
+    return (await graph_ready(story_id)).to_dict()
+
 
 @mcp.tool()
-def list_story_images(story_id: str) -> list[str]:
-    """Return list of available images for the specified story."""
-    return list(IMAGES.get(story_id, {}).keys())
+async def get_reachable_scenes(story_id: str, from_scene_id: str | None = None) -> list[str]:
+    """Return scene_ids reachable from a scene (default: the opening scene), including the scene itself."""
+    if story_id not in SCENES or not SCENES[story_id]:
+        return []
+    graph = await graph_ready(story_id)
+    scene_id = from_scene_id or graph.start
+    return sorted(graph.reachable_from(scene_id)) if graph.has_scene(scene_id) else []
 
 
 @mcp.tool()
-def get_scene(story_id: str, scene_id: str) -> dict:
-    """Return scene document (Markdown body + choices)."""
-    return SCENES.get(story_id, {}).get(scene_id, {})
+async def search_scenes(query: str, story_id: str | None = None, cursor: str | None = None, limit: int = 10) -> dict:
+    """Search scene bodies, choice texts and story metadata (Japanese included); return ranked hits.
+
+    Each hit is {story_id, scene_id (null for the story's meta), score, fields, snippet}. Restrict to one story
+    with story_id. Pass next_cursor back as cursor for the next page.
+    """
+    if scene_cache.lazy_enabled():  # lazy モードでは初回検索時にストーリーをループ外で索引する
+        builds = [_search_future(sid) for sid in ([story_id] if story_id else list(META)) if sid in META]
+        await asyncio.gather(*map(asyncio.wrap_future, builds))
+    return SEARCH.search(query, story_id, cursor, limit)
 
 
 @mcp.tool()
 def get_player_path(player_id: str) -> list[str]:
     """Return list of visited scene_ids for the player."""
-    return PLAYER_PATH[player_id]
+    return SESSIONS.path(player_id)
+
+
+@mcp.tool()
+def get_prefetch_stats() -> dict:
+    """Return prefetch counters: scheduled / completed / skipped items and how many were used or wasted."""
+    return PREFETCH.stats()
+
+
+@mcp.tool()
+def get_server_metrics(format: str = "json") -> dict | str:
+    """Return per tool call counts, errors, latency and payload percentiles, plus cache, pool, prefetch and session stats.
+
+    format="prometheus" returns the Prometheus text exposition format instead.
+    """
+    if format == "prometheus":
+        return METRICS.prometheus()
+    if format != "json":
+        raise ValueError(f"Unknown metrics format: {format} (use json or prometheus)")
+    return METRICS.snapshot()
+
+
+@mcp.tool()
+def get_story_log(
+    story_id: str,
+    cursor: str | None = None,
+    limit: int = 100,
+    since: str | None = None,
+    until: str | None = None,
+    event: str | None = None,
+    player_id: str | None = None,
+) -> dict:
+    """Return one page of the story's chronological event log.
+
+    Filter by ISO timestamps (since/until, inclusive), event type ("start", "choice")
+    and player_id. Pass next_cursor back as cursor to get the next page.
+    """
+    return LOG.query(story_id, cursor, limit, since, until, event, player_id)
 
 
 @mcp.tool()
-def get_story_log(story_id: str) -> list[dict]:
-    """Return chronological event log for the story."""
-    return LOG[story_id]
+async def export_story_log(
+    story_id: str,
+    cursor: str | None = None,
+    since: str | None = None,
+    until: str | None = None,
+    event: str | None = None,
+    player_id: str | None = None,
+) -> dict:
+    """Export the (filtered) event log as JSONL text, in chunks of up to 512 KiB.
+
+    Returns {"jsonl", "events", "next_cursor"}; pass next_cursor back as cursor until it is null
+    and concatenate the jsonl parts.
+    """
+    def export() -> dict:
+        if cursor is None:
+            LOG.flush()  # 最初のチャンクは呼び出し時点までの書き込みを含める
+        return LOG.export_chunk(story_id, cursor, since=since, until=until, event=event, player_id=player_id)
+
+    return await asyncio.to_thread(export)  # バックエンドの読み込みはループ外で行う
 
 
 # ---------------------------------------------------------------------------
@@ -151,11 +414,11 @@ def select_story(player_id: str, story_id: str) -> dict:
         intro_scene = "intro" if "intro" in SCENES[story_id] else sorted(SCENES[story_id].keys())[0]
         STATE[story_id] = {"scene_id": intro_scene, "flags": {}, "summary": ""}
     
-    CURRENT_STORY[player_id] = story_id
-    PLAYER_PATH[player_id].clear()
-    LOG[story_id].append({"ts": now_ts(), "event": "start", "player_id": player_id})
+    LOG.append(story_id, {"ts": now_ts(), "event": "start", "player_id": player_id})
     
     first_scene = STATE[story_id]["scene_id"]
+    SESSIONS.start(player_id, story_id, first_scene)
+    PREFETCH.schedule(player_id, story_id, first_scene, SCENES[story_id], IMAGES.get(story_id, {}))
     return {"story_id": story_id, "scene_id": first_scene, "scene": SCENES[story_id][first_scene]}
 
 
@@ -167,23 +430,34 @@ def choose(
     free_text: str | None = None,
 ) -> str:
     """Record player's choice within their selected story."""
-    story_id = CURRENT_STORY.get(player_id)
+    story_id = SESSIONS.current_story(player_id)
     if story_id is None:
         raise ValueError("Story not selected. Call select_story first.")
     
     if story_id not in SCENES:
         raise ValueError(f"Invalid story_id: {story_id}")
         
-    if current_scene_id not in SCENES[story_id]:
+    graph = graph_for(story_id)
+    if graph is None:  # lazy モードで選択肢索引を読んでいる間は現在のシーンだけで検証する
+        graph = story_graph.SceneChoices(current_scene_id, SCENES[story_id].get(current_scene_id), SCENES[story_id])
+    if not graph.has_scene(current_scene_id):
         raise ValueError(f"Invalid scene id {current_scene_id} for story {story_id}")
     
-    # 選択肢の検証（オプション）
-    scene = SCENES[story_id][current_scene_id]
-    if "choices" in scene and choice_id not in [c.get("id") for c in scene.get("choices", [])]:
-        print(f"Warning: Potentially invalid choice_id {choice_id} for scene {current_scene_id}")
-
-    PLAYER_PATH[player_id].append(current_scene_id)
-    LOG[story_id].append(
+    # 選択肢の検証（オプション）: グラフの索引で定数時間
+    if graph.edges[current_scene_id] and not graph.has_choice(current_scene_id, choice_id):
+        logger.warning("Potentially invalid choice_id %s for scene %s", choice_id, current_scene_id)
+
+    # プレイヤー自身の状態だけを進める（遷移先が存在しない場合はその場に留まる）
+    state = SESSIONS.advance(
+        player_id,
+        current_scene_id,
+        graph.resolve(current_scene_id, choice_id),
+        graph.flags.get((current_scene_id, choice_id)),
+    )
+    PREFETCH.note_scene(player_id, story_id, state.scene_id)
+    PREFETCH.schedule(player_id, story_id, state.scene_id, SCENES[story_id], IMAGES.get(story_id, {}))
+    LOG.append(
+        story_id,
         {
             "ts": now_ts(),
             "event": "choice",
@@ -193,52 +467,139 @@ def choose(
                 "choice": choice_id,
                 "free": free_text,
             },
-        }
+        },
     )
     return "ok"
 
 @mcp.tool()
-def load_scene_image(player_id: str, scene_id: str, max_width: int = 1024, max_height: int = 1024) -> Image:
-    """Return the image for the player's current story and scene. Resize and compress until data size <= 1MB."""
-    story_id = CURRENT_STORY.get(player_id)
+async def load_scene_image(
+    player_id: str,
+    scene_id: str,
+    max_width: int = 1024,
+    max_height: int = 1024,
+    format: str | None = None,
+    preset: str = "balanced",
+) -> Image | list:
+    """Return the image for the player's current story and scene. Resize and compress until data size <= 1MB.
+
+    format: accepted formats by preference, e.g. "avif,webp" (default: the source's PNG/JPEG); the first one
+    this server can encode is used. preset: "quality", "balanced" or "size". When format is given, a JSON
+    report (chosen format, bytes, bytes_saved, encode_ms or null when served from cache) precedes the image.
+    """
+    story_id = SESSIONS.current_story(player_id)
     if story_id is None:
         raise ValueError("Story not selected. Call select_story first.")
     image_path = IMAGES.get(story_id, {}).get(scene_id)
     if not image_path:
         raise FileNotFoundError(f"No image found for story={story_id}, scene={scene_id}")
 
-    with PILImage.open(image_path) as img:
-        ext = (img.format or "PNG").upper()
-        width, height = img.size
-        cur_width, cur_height = min(width, max_width), min(height, max_height)
-        min_size = 50  # さらに小さく
-        quality = 85 if ext in ("JPEG", "JPG") else None
-        min_quality = 40
-
-        while True:
-            img_copy = img.copy()
-            img_copy.thumbnail((cur_width, cur_height), PILImage.LANCZOS)
-            buf = io.BytesIO()
-            if ext in ("JPEG", "JPG"):
-                img_copy.save(buf, format="JPEG", quality=quality)
-            else:
-                img_copy.save(buf, format="PNG", optimize=True, compress_level=9)
-            size = buf.tell()
-            if size <= 1048576 or (cur_width <= min_size or cur_height <= min_size):
+    target = imaging.negotiate(format)
+    if preset not in imaging.PRESETS:
+        raise ValueError(f"Unknown preset: {preset} (use {', '.join(imaging.PRESETS)})")
+    PREFETCH.note_image(player_id, story_id, scene_id, max_width, max_height, target, preset)
+    try:
+        rendered = await IMAGE_POOL.render(image_path, max_width, max_height, target, preset)
+    except ValueError as e:
+        raise ValueError(f"{e}. Fetch the original in chunks with get_scene_image_original instead.") from e
+    image = Image(data=rendered.data, format=rendered.format.lower())  # キャッシュ済みなら mmap の memoryview をそのまま base64 化する
+    if format is None:
+        return image
+    size, source_size = len(rendered.data), os.path.getsize(image_path)
+    return [image, {
+        "format": rendered.format.lower(),
+        "preset": preset,
+        "bytes": size,
+        "source_bytes": source_size,
+        "bytes_saved": source_size - size,
+        "encode_ms": round(rendered.encode_seconds * 1000, 1) if rendered.encode_seconds is not None else None,
+    }]
+
+
+@mcp.tool()
+async def get_scene_image_original(player_id: str, scene_id: str, chunk: int = 0) -> dict:
+    """Return one chunk of the untouched original image for the player's current story and scene.
+
+    For images too large for load_scene_image without heavy recompression. The reply has the file's
+    size, sha256 and number of chunks; fetch chunk 0..chunks-1 and concatenate the base64-decoded data.
+    """
+    story_id = SESSIONS.current_story(player_id)
+    if story_id is None:
+        raise ValueError("Story not selected. Call select_story first.")
+    image_path = IMAGES.get(story_id, {}).get(scene_id)
+    if not image_path:
+        raise FileNotFoundError(f"No image found for story={story_id}, scene={scene_id}")
+
+    sha256 = await asyncio.to_thread(IMAGE_CACHE.source_hash, image_path)  # 初回は元画像全体を読む
+    info = await asyncio.to_thread(image_chunks.describe, image_path, sha256)
+    data = await asyncio.to_thread(image_chunks.read_chunk_base64, image_path, chunk)
+    return {**info, "chunk": chunk, "data": data}
+
+
+@mcp.tool()
+def play_turn(player_id: str, choice_id: str | None = None, free_text: str | None = None) -> dict:
+    """One narrator turn in one call: record the choice (if given) and return the player's next scene.
+
+    Returns the scene document, its choices (id, text), an image reference for
+    load_scene_image (or null) and the player's updated state and path.
+    """
+    state = SESSIONS.state(player_id)
+    if state is None:
+        raise ValueError("Story not selected. Call select_story first.")
+    story_id = state.story_id
+    if choice_id is not None:
+        choose(player_id, state.scene_id, choice_id, free_text)
+        state = SESSIONS.state(player_id)
+    scene_id = state.scene_id
+    scene = SCENES.get(story_id, {}).get(scene_id, {})
+    image_path = IMAGES.get(story_id, {}).get(scene_id)
+    return {
+        "story_id": story_id,
+        "scene_id": scene_id,
+        "scene": scene,
+        "choices": [{"id": c.get("id"), "text": c.get("text")} for c in scene.get("choices") or []],
+        "image": {"scene_id": scene_id, "file": os.path.basename(image_path)} if image_path else None,
+        "state": state.to_dict(),
+    }
+
+
+MAX_BATCH = 64
+BATCH_TOOLS: dict[str, Callable] = {fn.__name__: fn for fn in (
+    list_stories, get_story_meta, get_story_state, list_story_images, get_scene, get_story_graph,
+    get_reachable_scenes, search_scenes, get_player_path, get_prefetch_stats, get_server_metrics,
+    get_story_log, export_story_log, select_story, choose, play_turn,
+)}  # 画像はバイナリなので load_scene_image を直接呼ぶ
+
+
+@mcp.tool()
+async def batch(operations: list[dict], stop_on_error: bool = False) -> list[dict]:
+    """Run several tool calls in one request, in order.
+
+    operations: [{"tool": "<tool name>", "args": {...}}, ...] (any tool except load_scene_image and batch).
+    Returns one {"tool", "ok": true, "result"} or {"tool", "ok": false, "error"} per operation.
+    """
+    if len(operations) > MAX_BATCH:
+        raise ValueError(f"Too many operations: {len(operations)} > {MAX_BATCH}")
+    results = []
+    for op in operations:
+        name = op.get("tool")
+        try:
+            fn = BATCH_TOOLS.get(name)
+            if fn is None:
+                raise ValueError(f"Unknown or unsupported tool in batch: {name}")
+            RATE_LIMITS.charge(name, op.get("args") or {})
+            result = fn(**(op.get("args") or {}))
+            if inspect.isawaitable(result):
+                result = await result
+            if isinstance(result, response_cache.CachedJSON):
+                result = result.value  # 事前シリアライズ済みの応答はデコードして返す
+            results.append({"tool": name, "ok": True, "result": result})
+        except Exception as e:
+            results.append({"tool": name, "ok": False, "error": f"{type(e).__name__}: {e}"})
+            if stop_on_error:
                 break
-            # さらに縮小
-            cur_width = int(cur_width * 0.8)
-            cur_height = int(cur_height * 0.8)
-            # JPEGの場合はqualityも下げる
-            if ext in ("JPEG", "JPG") and quality > min_quality:
-                quality = max(min_quality, int(quality * 0.9))
-        buf.seek(0)
-        if size > 1048576:
-            raise ValueError(
-                f"Image is too large even after repeated resizing/compression. "
-                f"Original: {width}x{height}, Final: {cur_width}x{cur_height}, Size: {size} bytes, Quality: {quality}"
-            )
-        return Image(data=buf.read())
+    return results
+
+
 
 # ---------------------------------------------------------------------------
 # 5) Prompt
@@ -256,6 +617,7 @@ def narrator_prompt(language: str = "Japanese") -> str:
         "Write vivid {language} prose (max 1000 chars). "
         "Use image of current scene in load_scene_image. "
         "You can use all available tools (e.g., get_scene, story_state, list_story_images, load_scene_image, etc). "
+        "Prefer play_turn (records the choice and returns the next scene in one call) and batch for several lookups. "
         "Keep continuity with the existing story world and flags. "
         "Do not reveal hidden game mechanics or internal data."
         "</Constraints>"
@@ -267,4 +629,4 @@ def narrator_prompt(language: str = "Japanese") -> str:
 # ---------------------------------------------------------------------------
 
 if __name__ == "__main__":
-    mcp.run()
\ No newline at end of file
+    workers.run(mcp)  # NOVEL_TRANSPORT=sse で HTTP/SSE（workers.py 参照）
\ No newline at end of file
@@ -0,0 +1,333 @@
+"""Durable player sessions: the selected story and per-story player state.
+
+Each player keeps one :class:`PlayerState` per story they have played
+(current scene, flags, summary and a bounded history of visited scenes), so
+players never share mutable state. ``choose`` advances the state to the
+chosen choice's ``next`` scene and merges the choice's optional ``flags``.
+
+Tools read and update sessions in memory through :class:`Sessions`; changed
+sessions are only marked dirty and a background thread writes them to the
+store in batches (write-behind), so ``choose`` never waits on disk. A player
+seen for the first time since startup is restored lazily from the store.
+Read-only lookups of unknown players do not create sessions, and at most
+``max_sessions`` are kept in memory: the least recently used clean sessions
+are dropped (they are in the store and restored on the next access). Unknown
+player_ids are remembered as well (up to ``max_sessions`` of them), so
+repeated lookups of a player who has no session do not query the store each
+time; only this process creates sessions in an unshared store, so the entry
+stays valid until it does.
+
+When several worker processes share one store (see workers.py), set
+``NOVEL_SESSION_SHARED=1``: sessions are then read from the store on every
+access and written through immediately, so any worker sees the latest state.
+This costs one store query per lookup, including lookups of unknown players.
+
+Configuration (environment):
+    NOVEL_SESSION_STORE  "sqlite" (default) or "memory"
+    NOVEL_SESSION_PATH   SQLite database file (default: .cache/sessions.sqlite3)
+    NOVEL_SESSION_FLUSH  seconds between write-behind flushes (default: 0.2)
+    NOVEL_SESSION_SHARED "1": no in-process cache, write-through (store shared by worker processes)
+    NOVEL_SESSION_CACHE  sessions kept in memory (default: 10000)
+    NOVEL_PATH_HISTORY   visited scenes kept per player and story (default: 256)
+"""
+
+from collections import OrderedDict, deque
+import atexit
+import json
+import logging
+import os
+import pathlib
+import sqlite3
+import threading
+
+logger = logging.getLogger("novelgame.session_store")
+
+ROOT = pathlib.Path(__file__).parent
+DEFAULT_PATH = ROOT.parent / ".cache" / "sessions.sqlite3"
+MAX_HISTORY = int(os.environ.get("NOVEL_PATH_HISTORY", 256))
+
+
+class PlayerState:
+    """One player's progress through one story."""
+
+    __slots__ = ("story_id", "scene_id", "flags", "summary", "history")
+
+    def __init__(self, story_id: str, scene_id: str, flags: dict | None = None, summary: str = "",
+                 history=(), max_history: int = MAX_HISTORY):
+        self.story_id = story_id
+        self.scene_id = scene_id
+        self.flags = flags if flags is not None else {}
+        self.summary = summary
+        self.history: deque[str] = deque(history, maxlen=max_history)
+
+    def advance(self, from_scene: str, to_scene: str | None, flags: dict | None = None) -> None:
+        """Record ``from_scene`` as visited and move to ``to_scene`` (stay put when None)."""
+        self.history.append(from_scene)
+        if to_scene is not None:
+            self.scene_id = to_scene
+        if flags:
+            self.flags.update(flags)
+
+    def to_dict(self) -> dict:
+        """Same shape as STATE[story_id], plus the visited-scene history."""
+        return {"scene_id": self.scene_id, "flags": self.flags, "summary": self.summary, "path": list(self.history)}
+
+    @classmethod
+    def from_dict(cls, story_id: str, data: dict) -> "PlayerState":
+        return cls(story_id, data["scene_id"], dict(data.get("flags", {})), data.get("summary", ""), data.get("path", ()))
+
+
+class PlayerSession:
+    __slots__ = ("story_id", "states")
+
+    def __init__(self, story_id: str | None = None, states: dict[str, PlayerState] | None = None):
+        self.story_id = story_id  # 現在選択中のストーリー
+        self.states = states if states is not None else {}
+
+    @property
+    def state(self) -> PlayerState | None:
+        return self.states.get(self.story_id) if self.story_id is not None else None
+
+    def to_record(self) -> dict:
+        return {"story_id": self.story_id, "states": {sid: st.to_dict() for sid, st in self.states.items()}}
+
+    @classmethod
+    def from_record(cls, record: dict) -> "PlayerSession":
+        story_id = record.get("story_id")
+        states = {sid: PlayerState.from_dict(sid, data) for sid, data in record.get("states", {}).items()}
+        return cls(story_id, states)
+
+
+class SessionStore:
+    """Backend for session records (plain JSON-able dicts keyed by player_id)."""
+
+    def load(self, player_id: str) -> dict | None:
+        raise NotImplementedError
+
+    def save_batch(self, records: dict[str, dict]) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class MemorySessionStore(SessionStore):
+    """In-process store: survives nothing, but lets the write-behind path run without disk."""
+
+    def __init__(self):
+        self._records: dict[str, str] = {}
+
+    def load(self, player_id: str) -> dict | None:
+        data = self._records.get(player_id)
+        return json.loads(data) if data is not None else None
+
+    def save_batch(self, records: dict[str, dict]) -> None:
+        for player_id, record in records.items():
+            self._records[player_id] = json.dumps(record)
+
+
+class SqliteSessionStore(SessionStore):
+    def __init__(self, path: str | os.PathLike):
+        self.path = str(path)
+        pathlib.Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, timeout=30.0, check_same_thread=False)  # 他のワーカーの書き込み待ち
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (player_id TEXT PRIMARY KEY, data TEXT NOT NULL)"
+        )
+        self._lock = threading.Lock()  # 読み込み（ツール側）と書き込み（フラッシュ側）で接続を共有する
+
+    def load(self, player_id: str) -> dict | None:
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM sessions WHERE player_id = ?", (player_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_batch(self, records: dict[str, dict]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO sessions (player_id, data) VALUES (?, ?) "
+                "ON CONFLICT(player_id) DO UPDATE SET data = excluded.data",
+                [(player_id, json.dumps(record, ensure_ascii=False)) for player_id, record in records.items()],
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class Sessions:
+    """In-memory sessions with lazy restore and write-behind persistence (write-through when ``shared``)."""
+
+    def __init__(self, store: SessionStore, flush_interval: float = 0.2, shared: bool = False,
+                 max_sessions: int = 10000):
+        self.store = store
+        self.flush_interval = flush_interval
+        self.shared = shared  # 複数プロセスで store を共有する: キャッシュせず即時に書き込む
+        self.max_sessions = max_sessions
+        self.restored = 0
+        self.evicted = 0
+        self.flushes = 0
+        self._sessions: OrderedDict[str, PlayerSession] = OrderedDict()  # LRU（古い順）
+        self._missing: OrderedDict[str, None] = OrderedDict()  # store にないと分かっている player_id（LRU）
+        self._dirty: set[str] = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="session-writer", daemon=True)
+        self._thread.start()
+
+    def find(self, player_id: str) -> PlayerSession | None:
+        """Session for ``player_id`` if it exists (in memory or in the store); never creates one."""
+        if self.shared:
+            record = self.store.load(player_id)
+            return PlayerSession.from_record(record) if record is not None else None
+        with self._lock:
+            session = self._sessions.get(player_id)
+            if session is not None:
+                self._sessions.move_to_end(player_id)
+                return session
+            if player_id in self._missing:
+                self._missing.move_to_end(player_id)
+                return None
+        record = self.store.load(player_id)
+        if record is None:
+            with self._lock:
+                if player_id not in self._sessions:  # 問い合わせ中に作られていなければ
+                    self._missing[player_id] = None
+                    while len(self._missing) > self.max_sessions:
+                        self._missing.popitem(last=False)
+            return None
+        self.restored += 1
+        return self._remember(player_id, PlayerSession.from_record(record))
+
+    def get(self, player_id: str) -> PlayerSession:
+        """Session for ``player_id``, restored from the store or created (for updates)."""
+        session = self.find(player_id)
+        if session is None:
+            session = PlayerSession() if self.shared else self._remember(player_id, PlayerSession())
+        return session
+
+    def _remember(self, player_id: str, session: PlayerSession) -> PlayerSession:
+        with self._lock:
+            self._missing.pop(player_id, None)
+            session = self._sessions.setdefault(player_id, session)
+            self._sessions.move_to_end(player_id)
+            self._evict()
+        return session
+
+    def _evict(self) -> None:
+        """Drop least recently used clean sessions beyond ``max_sessions`` (needs the lock)."""
+        if len(self._sessions) <= self.max_sessions:
+            return
+        for player_id in list(self._sessions)[:-1]:  # 今追加したもの（末尾）は残す
+            if len(self._sessions) <= self.max_sessions:
+                break
+            if player_id not in self._dirty:  # 未保存のものは書き込み後に追い出す
+                del self._sessions[player_id]
+                self.evicted += 1
+
+    def _changed(self, player_id: str, session: PlayerSession) -> None:
+        if self.shared:
+            self.store.save_batch({player_id: session.to_record()})
+            return
+        with self._lock:
+            # get() と変更の間に追い出されていても、フラッシュ対象として戻す
+            self._missing.pop(player_id, None)
+            self._sessions[player_id] = session
+            self._sessions.move_to_end(player_id)
+            self._dirty.add(player_id)
+
+    def current_story(self, player_id: str) -> str | None:
+        session = self.find(player_id)
+        return session.story_id if session is not None else None
+
+    def state(self, player_id: str, story_id: str | None = None) -> PlayerState | None:
+        """The player's state in ``story_id`` (default: their current story)."""
+        session = self.find(player_id)
+        if session is None:
+            return None
+        return session.states.get(story_id) if story_id is not None else session.state
+
+    def path(self, player_id: str) -> list[str]:
+        session = self.find(player_id)
+        state = session.state if session is not None else None
+        return list(state.history) if state is not None else []
+
+    def start(self, player_id: str, story_id: str, scene_id: str) -> PlayerState:
+        """Select ``story_id`` and (re)start it from ``scene_id``."""
+        session = self.get(player_id)
+        session.story_id = story_id
+        state = session.states[story_id] = PlayerState(story_id, scene_id)
+        self._changed(player_id, session)
+        return state
+
+    def advance(self, player_id: str, from_scene: str, to_scene: str | None, flags: dict | None = None) -> PlayerState:
+        session = self.get(player_id)
+        state = session.state
+        if state is None:
+            state = session.states[session.story_id] = PlayerState(session.story_id, from_scene)
+        state.advance(from_scene, to_scene, flags)
+        self._changed(player_id, session)
+        return state
+
+    def flush(self) -> None:
+        """Write every dirty session to the store now."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            records = {pid: self._sessions[pid].to_record() for pid in dirty if pid in self._sessions}
+        if not records:
+            return
+        try:
+            self.store.save_batch(records)
+            self.flushes += 1
+            with self._lock:
+                self._evict()  # 保存済みになったので追い出せる
+        except Exception as e:
+            with self._lock:
+                self._dirty |= dirty  # 次回のフラッシュで再試行
+            logger.error("Error saving %d sessions: %s", len(records), e)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def close(self) -> None:
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join()
+        self.flush()
+        self.store.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            dirty = len(self._dirty)
+        return {
+            "store": type(self.store).__name__,
+            "shared": self.shared,
+            "sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "known_missing": len(self._missing),
+            "dirty": dirty,
+            "restored": self.restored,
+            "evicted": self.evicted,
+            "flushes": self.flushes,
+        }
+
+
+def from_env() -> Sessions:
+    """Build sessions from NOVEL_SESSION_STORE / NOVEL_SESSION_PATH / NOVEL_SESSION_FLUSH / NOVEL_SESSION_SHARED / NOVEL_SESSION_CACHE."""
+    kind = os.environ.get("NOVEL_SESSION_STORE", "sqlite")
+    if kind == "sqlite":
+        store = SqliteSessionStore(os.environ.get("NOVEL_SESSION_PATH", DEFAULT_PATH))
+    elif kind == "memory":
+        store = MemorySessionStore()
+    else:
+        raise ValueError(f"Unknown NOVEL_SESSION_STORE: {kind}")
+    shared = os.environ.get("NOVEL_SESSION_SHARED", "0") == "1"
+    if shared and kind == "memory":
+        raise ValueError("NOVEL_SESSION_SHARED=1 needs a store shared between processes (NOVEL_SESSION_STORE=sqlite)")
+    sessions = Sessions(store, float(os.environ.get("NOVEL_SESSION_FLUSH", 0.2)), shared,
+                        int(os.environ.get("NOVEL_SESSION_CACHE", 10000)))
+    atexit.register(sessions.close)
+    return sessions
@@ -0,0 +1,160 @@
+"""Compiled story bundles: one binary file per story directory.
+
+Layout::
+
+    MAGIC | u32 header length | header | body
+
+``header`` is a pickled dict holding the source manifest (mtime/size of every
+scene YAML plus the image file names), the image and file → scene_id mappings,
+the story's choice index (see story_graph.py) and an index of
+``(offset, length)`` for ``meta`` and each scene inside ``body``. Every document
+is pickled separately, so a reader can memory-map the file and decode only the
+scenes it needs. (pickle rather than marshal: YAML yields ``datetime.date``
+values, e.g. ``created:`` in meta.yaml, which marshal cannot store.) Bundles
+are local build artifacts; never load one from an untrusted source.
+
+Build every story ahead of time::
+
+    uv run src/story_bundle.py
+"""
+
+import mmap
+import os
+import pathlib
+import pickle
+import struct
+
+ROOT = pathlib.Path(__file__).parent
+DEFAULT_BUNDLE_DIR = ROOT.parent / ".cache" / "bundles"
+BUNDLE_SUFFIX = ".bundle"
+MAGIC = b"NVSB\x03"
+_HEADER_LEN = struct.Struct(">I")
+_IMAGE_SUFFIXES = (".png", ".jpg")
+
+
+def source_manifest(story_dir: pathlib.Path) -> dict:
+    """Fingerprint of the sources a bundle was built from (one scandir per directory)."""
+    files = {}
+    with os.scandir(story_dir) as it:
+        for entry in it:
+            if entry.name.endswith(".yaml") and entry.is_file():
+                st = entry.stat()
+                files[entry.name] = (st.st_mtime_ns, st.st_size)
+    images = []
+    try:
+        with os.scandir(story_dir / "images") as it:
+            images = sorted(e.name for e in it if e.name.endswith(_IMAGE_SUFFIXES))
+    except FileNotFoundError:
+        pass
+    return {"files": files, "images": images}
+
+
+class Bundle:
+    """Read-only, memory-mapped view of a bundle file."""
+
+    def __init__(self, path: str | os.PathLike):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if self._mm[:len(MAGIC)] != MAGIC:
+                raise ValueError(f"Not a story bundle: {path}")
+            start = len(MAGIC) + _HEADER_LEN.size
+            (header_len,) = _HEADER_LEN.unpack_from(self._mm, len(MAGIC))
+            header = pickle.loads(self._mm[start:start + header_len])
+        except BaseException:
+            self._mm.close()
+            raise
+        self._body = start + header_len
+        self.manifest: dict = header["manifest"]
+        self.images: dict[str, str] = header["images"]  # scene_id → file name in images/
+        self.files: dict[str, str] = header["files"]  # scene YAML file name → scene_id
+        self.choices: dict[str, list[dict]] = header["choices"]  # scene_id → choices (id / next / flags)
+        self._meta = header["meta"]
+        self._index: dict[str, tuple[int, int]] = header["scenes"]
+
+    def _load(self, offset: int, length: int):
+        start = self._body + offset
+        return pickle.loads(self._mm[start:start + length])
+
+    @property
+    def scene_ids(self) -> list[str]:
+        return list(self._index)
+
+    def meta(self) -> dict:
+        return self._load(*self._meta)
+
+    def scene(self, scene_id: str) -> dict:
+        return self._load(*self._index[scene_id])
+
+    def scenes(self) -> dict[str, dict]:
+        return {scene_id: self._load(*span) for scene_id, span in self._index.items()}
+
+    def close(self) -> None:
+        self._mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_bundle(path: pathlib.Path, manifest: dict) -> Bundle | None:
+    """Open the bundle at ``path`` if it exists and matches ``manifest``."""
+    try:
+        bundle = Bundle(path)
+    except (OSError, ValueError, EOFError, KeyError, TypeError, struct.error, pickle.UnpicklingError):
+        return None
+    if bundle.manifest != manifest:
+        bundle.close()
+        return None
+    return bundle
+
+
+def write_bundle(path: pathlib.Path, story, manifest: dict) -> None:
+    """Write ``story`` (a story_loader.StoryData) atomically to ``path``."""
+    body = bytearray()
+
+    def add(doc) -> tuple[int, int]:
+        blob = pickle.dumps(doc, pickle.HIGHEST_PROTOCOL)
+        offset = len(body)
+        body.extend(blob)
+        return offset, len(blob)
+
+    header = {
+        "manifest": manifest,
+        "images": {scene_id: os.path.basename(p) for scene_id, p in story.images.items()},
+        "files": story.files,
+        "choices": story.choices,
+        "meta": add(story.meta),
+        "scenes": {scene_id: add(doc) for scene_id, doc in story.scenes.items()},
+    }
+    header_blob = pickle.dumps(header, pickle.HIGHEST_PROTOCOL)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(_HEADER_LEN.pack(len(header_blob)))
+        f.write(header_blob)
+        f.write(body)
+    os.replace(tmp, path)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import story_loader
+
+    parser = argparse.ArgumentParser(description="Compile every story directory into a bundle.")
+    parser.add_argument("--stories", type=pathlib.Path, default=ROOT / "stories")
+    parser.add_argument("--out", type=pathlib.Path, default=story_loader.bundle_dir_from_env() or DEFAULT_BUNDLE_DIR)
+    args = parser.parse_args()
+
+    for story_dir in story_loader.story_dirs(args.stories):
+        story = story_loader.parse_story_dir(story_dir)
+        if story.errors:  # サーバーの起動時と同じく、読めないファイルがあるストーリーはバンドルにしない
+            print(f"{story.story_id}: skipped ({len(story.errors)} parse errors)")
+            continue
+        story_loader._write_bundle(story, story_dir, args.out, source_manifest(story_dir))
+        print(f"{story.story_id}: {len(story.scenes)} scenes → {args.out / f'{story.story_id}{BUNDLE_SUFFIX}'}")
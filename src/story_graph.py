@@ -0,0 +1,126 @@
+"""Branching structure of a story, precomputed from its choice index.
+
+:class:`StoryGraph` maps every (scene_id, choice_id) to its target scene, so
+``choose`` validates and resolves a choice with two dict lookups. It also
+records reverse edges and classifies scenes:
+
+- endings:     scenes without choices
+- unreachable: scenes that cannot be reached from the opening scene
+- dead_ends:   reachable scenes from which no ending can be reached (endless loops)
+- broken:      choices whose ``next`` is not a scene of the story
+
+The graph only needs each scene's choices, not the scene documents: the
+loader keeps that :func:`choice_index` next to the scenes (and in the story
+bundle), so a lazily loaded story gets its graph without parsing every scene.
+"""
+
+from collections import deque
+from collections.abc import Container, Iterable, Mapping
+
+_CHOICE_KEYS = ("id", "next", "flags")
+
+
+def choice_index(scenes: Iterable[tuple[str, dict]]) -> dict[str, list[dict]]:
+    """scene_id → the scene's choices, reduced to ``id`` / ``next`` / ``flags``."""
+    return {
+        scene_id: [{k: choice[k] for k in _CHOICE_KEYS if k in choice} for choice in doc.get("choices") or []]
+        for scene_id, doc in scenes
+    }
+
+
+class StoryGraph:
+    def __init__(self, story_id: str, choices: Mapping[str, list[dict]], start: str):
+        self.story_id = story_id
+        self.start = start
+        self.edges: dict[str, dict[str, str | None]] = {}  # scene_id → choice_id → target (None: no next)
+        self.flags: dict[tuple[str, str], dict] = {}  # (scene_id, choice_id) → flags set by the choice
+        self.reverse: dict[str, list[tuple[str, str]]] = {scene_id: [] for scene_id in choices}
+        self.broken: list[tuple[str, str, str | None]] = []  # (scene_id, choice_id, next)
+        for scene_id, scene_choices in choices.items():
+            out = self.edges[scene_id] = {}
+            for choice in scene_choices:
+                choice_id, target = choice.get("id"), choice.get("next")
+                out[choice_id] = target
+                if choice.get("flags"):
+                    self.flags[scene_id, choice_id] = choice["flags"]
+                if target in self.reverse:
+                    self.reverse[target].append((scene_id, choice_id))
+                else:
+                    self.broken.append((scene_id, choice_id, target))
+
+        self.endings = frozenset(s for s, out in self.edges.items() if not out)
+        self._reachable: dict[str, frozenset[str]] = {}
+        self.reachable = self.reachable_from(start) if start in self.edges else frozenset()
+        self.unreachable = frozenset(self.edges.keys() - self.reachable)
+        can_finish = self._backward(self.endings)
+        self.dead_ends = frozenset(s for s in self.reachable if s not in can_finish)
+
+    def _backward(self, targets: Iterable[str]) -> set[str]:
+        seen = set(targets)
+        todo = deque(seen)
+        while todo:
+            for source, _ in self.reverse.get(todo.popleft(), ()):
+                if source not in seen:
+                    seen.add(source)
+                    todo.append(source)
+        return seen
+
+    def has_scene(self, scene_id: str) -> bool:
+        return scene_id in self.edges
+
+    def has_choice(self, scene_id: str, choice_id: str) -> bool:
+        return choice_id in self.edges.get(scene_id, {})
+
+    def resolve(self, scene_id: str, choice_id: str) -> str | None:
+        """Target scene of the choice, or None if the choice or its target does not exist."""
+        target = self.edges.get(scene_id, {}).get(choice_id)
+        return target if target in self.edges else None
+
+    def reachable_from(self, scene_id: str) -> frozenset[str]:
+        """Scenes reachable from ``scene_id`` (including itself); memoized per scene."""
+        cached = self._reachable.get(scene_id)
+        if cached is None:
+            seen = {scene_id}
+            todo = deque(seen)
+            while todo:
+                for target in self.edges.get(todo.popleft(), {}).values():
+                    if target in self.edges and target not in seen:
+                        seen.add(target)
+                        todo.append(target)
+            cached = self._reachable[scene_id] = frozenset(seen)
+        return cached
+
+    def to_dict(self) -> dict:
+        return {
+            "story_id": self.story_id,
+            "start": self.start,
+            "edges": self.edges,
+            "reverse": {s: [{"scene_id": src, "choice_id": c} for src, c in sources] for s, sources in self.reverse.items()},
+            "endings": sorted(self.endings),
+            "unreachable": sorted(self.unreachable),
+            "dead_ends": sorted(self.dead_ends),
+            "broken": [{"scene_id": s, "choice_id": c, "next": t} for s, c, t in self.broken],
+        }
+
+
+class SceneChoices:
+    """The part of the StoryGraph API ``choose`` needs, for a single scene.
+
+    Used while a lazily loaded story's choice index is still being read.
+    """
+
+    def __init__(self, scene_id: str, doc: dict | None, scene_ids: Container[str]):
+        self._scene_ids = scene_ids
+        choices = choice_index([(scene_id, doc)])[scene_id] if doc is not None else []
+        self.edges = {scene_id: {choice.get("id"): choice.get("next") for choice in choices}}
+        self.flags = {(scene_id, choice.get("id")): choice["flags"] for choice in choices if choice.get("flags")}
+
+    def has_scene(self, scene_id: str) -> bool:
+        return scene_id in self._scene_ids
+
+    def has_choice(self, scene_id: str, choice_id: str) -> bool:
+        return choice_id in self.edges.get(scene_id, {})
+
+    def resolve(self, scene_id: str, choice_id: str) -> str | None:
+        target = self.edges.get(scene_id, {}).get(choice_id)
+        return target if target in self._scene_ids else None
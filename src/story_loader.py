@@ -0,0 +1,319 @@
+"""Load story directories (src/stories/<story_id>/) into memory.
+
+Each story is read from its compiled bundle (see story_bundle.py) when the
+bundle is up to date, and parsed from YAML (then re-bundled) otherwise. In
+lazy mode only meta.yaml and a scene-id index are read up front.
+
+:func:`load_catalog` parses the stories that need YAML (libyaml's
+``CSafeLoader`` when available) and returns them in story-id order together
+with a per-story report: source, load time and parse errors. Large catalogs
+are parsed in a pool of forked processes, one per NOVEL_LOAD_SCENES_PER_WORKER
+scene files at most; below that, starting processes costs more than it saves.
+Workers are forked (not spawned) so that they never re-import the server
+module; where fork is unavailable the stories are parsed serially.
+
+Configuration (environment):
+    NOVEL_LOAD_WORKERS            max processes for YAML parsing at startup (default: CPU count, 1 = serial)
+    NOVEL_LOAD_SCENES_PER_WORKER  min scene files per process (default: 1000)
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+import logging
+import multiprocessing
+import os
+import pathlib
+import pickle
+import re
+import time
+
+import yaml
+
+import scene_cache
+import story_bundle
+import story_graph
+
+logger = logging.getLogger("novelgame.story_loader")
+
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)  # libyaml があれば C 実装を使う
+
+
+def _safe_load(f):
+    return yaml.load(f, Loader=_YAML_LOADER)
+
+
+@dataclass(slots=True)
+class StoryData:
+    story_id: str
+    meta: dict
+    scenes: dict[str, dict] = field(default_factory=dict)
+    images: dict[str, str] = field(default_factory=dict)  # scene_id → absolute image path
+    files: dict[str, str] = field(default_factory=dict)  # scene YAML file name → scene_id
+    errors: list[str] = field(default_factory=list)  # "file: message" for files that failed to parse
+    choices: dict[str, list[dict]] | None = None  # story_graph.choice_index; None: not read yet (lazy index)
+
+
+@dataclass(slots=True)
+class StoryLoad:
+    story_id: str
+    source: str  # "bundle" / "yaml" / "index" (lazy mode)
+    seconds: float
+    scenes: int
+    images: int
+    errors: list[str]
+
+
+@dataclass(slots=True)
+class CatalogLoad:
+    stories: list[StoryData]  # story-id order
+    report: list[StoryLoad]
+    seconds: float
+    workers: int  # processes used for YAML parsing (1 = in this process)
+
+    def stats(self) -> dict:
+        return {
+            "stories": len(self.stories),
+            "scenes": sum(r.scenes for r in self.report),
+            "errors": sum(len(r.errors) for r in self.report),
+            "seconds": round(self.seconds, 3),
+            "workers": self.workers,
+            "by_story": {
+                r.story_id: {"source": r.source, "ms": round(r.seconds * 1000, 1), "scenes": r.scenes,
+                             "images": r.images, "errors": r.errors}
+                for r in self.report
+            },
+        }
+
+
+def parse_meta(story_dir: pathlib.Path, errors: list[str] | None = None) -> dict:
+    """Parse meta.yaml, falling back to ``{"title": story_id}``."""
+    story_id = story_dir.name
+    meta_path = os.path.join(str(story_dir), "meta.yaml")
+    if os.path.exists(meta_path):
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                return _safe_load(f)
+        except Exception as e:
+            logger.error("Error loading meta file for %s: %s", story_id, e)
+            if errors is not None:
+                errors.append(f"meta.yaml: {e}")
+            return {"title": story_id}  # 最低限のメタデータ
+    logger.warning("No meta.yaml found for %s", story_id)
+    return {"title": story_id}  # メタファイルがない場合のフォールバック
+
+
+def parse_scene_file(scene_file: pathlib.Path) -> tuple[str, dict]:
+    """Parse one scene YAML into (scene_id, document)."""
+    with open(scene_file, "r", encoding="utf-8") as f:
+        doc = _safe_load(f)
+    scene_id = doc.pop("id", scene_file.stem)  # ファイル名をフォールバックとして使用
+    return scene_id, {"type": "preset", **doc}
+
+
+def parse_story_dir(story_dir: pathlib.Path) -> StoryData:
+    """Parse meta.yaml, every scene YAML and the images/ directory of one story."""
+    errors: list[str] = []
+    story = StoryData(story_dir.name, parse_meta(story_dir, errors), errors=errors)
+
+    # シーンの読み込み（ファイル名順に読み、重複 ID は後勝ち）
+    for scene_file in sorted(story_dir.glob("*.yaml")):
+        if scene_file.name == "meta.yaml":
+            continue
+        try:
+            scene_id, doc = parse_scene_file(scene_file)
+            story.scenes[scene_id] = doc
+            story.files[scene_file.name] = scene_id
+        except Exception as e:
+            logger.error("Error loading scene file %s: %s", scene_file, e)
+            errors.append(f"{scene_file.name}: {e}")
+    story.images = images_for(story_dir, story.scenes)  # images/ は 1 回だけ列挙する
+    story.choices = story_graph.choice_index(story.scenes.items())
+    return story
+
+
+def _parse_timed(story_dir: pathlib.Path) -> tuple[StoryData, float]:
+    t = time.perf_counter()
+    story = parse_story_dir(story_dir)
+    return story, time.perf_counter() - t
+
+
+def images_for(story_dir: pathlib.Path, scene_ids) -> dict[str, str]:
+    """Map scene_ids to images/<scene_id>.png (preferred) or .jpg with one directory listing."""
+    images_dir = os.path.abspath(os.path.join(str(story_dir), "images"))
+    try:
+        names = set(os.listdir(images_dir))
+    except FileNotFoundError:
+        return {}
+    images = {}
+    for scene_id in scene_ids:
+        for name in (f"{scene_id}.png", f"{scene_id}.jpg"):  # PNG優先、なければJPG
+            if name in names:
+                images[scene_id] = os.path.join(images_dir, name)
+                break
+    return images
+
+
+_ID_LINE = re.compile(r"^id:[ \t]*['\"]?(.*?)['\"]?[ \t]*$", re.MULTILINE)
+
+
+def _scan_scene_id(scene_file: pathlib.Path) -> str:
+    """Read a scene's top-level ``id:`` without parsing the YAML document."""
+    with open(scene_file, "r", encoding="utf-8") as f:
+        m = _ID_LINE.search(f.read())
+    return m.group(1) if m and m.group(1) else scene_file.stem
+
+
+def index_story_dir(story_dir: pathlib.Path, cache: scene_cache.SceneCache) -> StoryData:
+    """meta.yaml plus a scene-id index; scene documents are parsed on first access."""
+    files: dict[str, pathlib.Path] = {}
+    errors: list[str] = []
+    for scene_file in sorted(story_dir.glob("*.yaml")):
+        if scene_file.name == "meta.yaml":
+            continue
+        try:
+            files[_scan_scene_id(scene_file)] = scene_file
+        except Exception as e:
+            logger.error("Error loading scene file %s: %s", scene_file, e)
+            errors.append(f"{scene_file.name}: {e}")
+
+    def load(scene_id: str) -> dict:
+        return parse_scene_file(files[scene_id])[1]
+
+    images = images_for(story_dir, files)
+    meta = parse_meta(story_dir, errors)
+    return StoryData(story_dir.name, meta,
+                     scene_cache.LazyScenes(story_dir.name, files, load, cache), images,
+                     {path.name: scene_id for scene_id, path in files.items()}, errors)
+
+
+def _bundle_path(story_dir: pathlib.Path, bundle_dir: pathlib.Path) -> pathlib.Path:
+    return bundle_dir / f"{story_dir.name}{story_bundle.BUNDLE_SUFFIX}"
+
+
+def _load_prepared(story_dir: pathlib.Path, bundle_dir: pathlib.Path | None,
+                   cache: scene_cache.SceneCache | None) -> tuple[StoryData | None, str, dict | None]:
+    """Load from a bundle or the lazy index; ``(None, "yaml", manifest)`` when YAML must be parsed."""
+    bundle, manifest = None, None
+    if bundle_dir is not None:
+        manifest = story_bundle.source_manifest(story_dir)
+        bundle = story_bundle.open_bundle(_bundle_path(story_dir, bundle_dir), manifest)
+    if bundle is not None:
+        images_dir = os.path.abspath(os.path.join(str(story_dir), "images"))
+        images = {scene_id: os.path.join(images_dir, name) for scene_id, name in bundle.images.items()}
+        if cache is not None:
+            # mmap はプロセス終了まで開いたまま、シーンは必要な時だけ復元する
+            scenes = scene_cache.LazyScenes(story_dir.name, bundle.scene_ids, bundle.scene, cache)
+            story = StoryData(story_dir.name, bundle.meta(), scenes, images, dict(bundle.files), choices=bundle.choices)
+            return story, "bundle", manifest
+        with bundle:
+            story = StoryData(story_dir.name, bundle.meta(), bundle.scenes(), images, dict(bundle.files),
+                              choices=bundle.choices)
+            return story, "bundle", manifest
+
+    if cache is not None:
+        return index_story_dir(story_dir, cache), "index", manifest
+    return None, "yaml", manifest
+
+
+def _write_bundle(story: StoryData, story_dir: pathlib.Path, bundle_dir: pathlib.Path | None, manifest) -> None:
+    # 読めなかったファイルがあるストーリーはバンドルにしない（次回の起動でもエラーを報告するため）
+    if bundle_dir is None or story.errors:
+        return
+    try:
+        story_bundle.write_bundle(_bundle_path(story_dir, bundle_dir), story, manifest)
+    except (OSError, pickle.PicklingError) as e:
+        logger.warning("Could not write bundle for %s: %s", story.story_id, e)
+
+
+def load_story(story_dir: pathlib.Path, bundle_dir: pathlib.Path | None = None,
+               cache: scene_cache.SceneCache | None = None) -> StoryData:
+    """Load one story, preferring an up-to-date bundle in ``bundle_dir``.
+
+    With ``cache`` the scenes are loaded lazily (see scene_cache.py) instead.
+    """
+    story, _, manifest = _load_prepared(story_dir, bundle_dir, cache)
+    if story is None:
+        story = parse_story_dir(story_dir)
+        _write_bundle(story, story_dir, bundle_dir, manifest)
+    return story
+
+
+def story_dirs(novel_dir: pathlib.Path) -> list[pathlib.Path]:
+    return sorted(p for p in novel_dir.glob("*") if p.is_dir())
+
+
+def _scene_file_count(dirs: list[pathlib.Path]) -> int:
+    return sum(1 for d in dirs for f in d.glob("*.yaml") if f.name != "meta.yaml")
+
+
+def _parse_all(dirs: list[pathlib.Path], workers: int,
+               scenes_per_worker: int) -> tuple[list[tuple[StoryData, float]], int]:
+    """Parse ``dirs`` in up to ``workers`` forked processes; results keep the order of ``dirs``.
+
+    Each process gets at least ``scenes_per_worker`` scene files, so small catalogs stay in this process.
+    """
+    workers = min(workers, len(dirs))
+    if workers > 1:
+        workers = min(workers, _scene_file_count(dirs) // max(1, scenes_per_worker))
+    if workers > 1:
+        try:
+            # spawn / forkserver だと子プロセスが __main__（サーバー）を読み込み直してしまう
+            context = multiprocessing.get_context("fork")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+                return list(pool.map(_parse_timed, dirs)), workers
+        except (OSError, ValueError, RuntimeError, BrokenProcessPool) as e:
+            logger.warning("Parallel story loading unavailable (%s); parsing serially", e)
+    return [_parse_timed(d) for d in dirs], 1
+
+
+def load_catalog(novel_dir: pathlib.Path, bundle_dir: pathlib.Path | None = None,
+                 cache: scene_cache.SceneCache | None = None, workers: int | None = None,
+                 scenes_per_worker: int | None = None) -> CatalogLoad:
+    """Load every story under ``novel_dir``. ``bundle_dir=None`` always parses YAML.
+
+    Bundles and lazy indexes are opened here (they hold mmaps / the scene
+    cache); stories that need a full YAML parse go to a pool of up to ``workers``
+    processes (default NOVEL_LOAD_WORKERS) with at least ``scenes_per_worker``
+    scene files each (default NOVEL_LOAD_SCENES_PER_WORKER).
+    """
+    if workers is None:
+        workers = load_workers_from_env()
+    if scenes_per_worker is None:
+        scenes_per_worker = int(os.environ.get("NOVEL_LOAD_SCENES_PER_WORKER", 1000))
+    start = time.perf_counter()
+    loaded: dict[str, tuple[StoryData, StoryLoad]] = {}
+    pending: list[tuple[pathlib.Path, dict | None]] = []
+    dirs = story_dirs(novel_dir)
+    for story_dir in dirs:
+        t = time.perf_counter()
+        story, source, manifest = _load_prepared(story_dir, bundle_dir, cache)
+        if story is None:
+            pending.append((story_dir, manifest))
+            continue
+        loaded[story.story_id] = story, StoryLoad(
+            story.story_id, source, time.perf_counter() - t, len(story.scenes), len(story.images), story.errors
+        )
+
+    parsed, used = _parse_all([story_dir for story_dir, _ in pending], workers, scenes_per_worker) if pending else ([], 1)
+    for (story_dir, manifest), (story, seconds) in zip(pending, parsed):
+        _write_bundle(story, story_dir, bundle_dir, manifest)
+        loaded[story.story_id] = story, StoryLoad(
+            story.story_id, "yaml", seconds, len(story.scenes), len(story.images), story.errors
+        )
+
+    ordered = [loaded[story_dir.name] for story_dir in dirs]
+    return CatalogLoad([story for story, _ in ordered], [report for _, report in ordered],
+                       time.perf_counter() - start, used)
+
+
+def load_workers_from_env() -> int:
+    """NOVEL_LOAD_WORKERS (default: CPU count)."""
+    return max(1, int(os.environ.get("NOVEL_LOAD_WORKERS", 0)) or os.cpu_count() or 1)
+
+
+def bundle_dir_from_env() -> pathlib.Path | None:
+    """NOVEL_BUNDLE_DIR (default .cache/bundles); NOVEL_STORY_BUNDLES=0 disables bundles."""
+    if os.environ.get("NOVEL_STORY_BUNDLES", "1") == "0":
+        return None
+    return pathlib.Path(os.environ.get("NOVEL_BUNDLE_DIR", story_bundle.DEFAULT_BUNDLE_DIR))
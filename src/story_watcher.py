@@ -0,0 +1,159 @@
+"""Hot reload of src/stories/ without restarting the server.
+
+A background thread polls every story directory (scene YAML, meta.yaml and
+images/) and, for each story that changed, re-parses only the files whose
+mtime/size changed. The rebuilt :class:`story_loader.StoryData` is handed to
+the server's ``apply`` callback, which swaps the entries in META / SCENES /
+IMAGES / STATE and invalidates derived caches. Unchanged scene documents are
+reused, and player state (SESSIONS, LOG) is untouched.
+
+Configuration (environment):
+    NOVEL_WATCH_STORIES   "1" to enable (default: off)
+    NOVEL_WATCH_INTERVAL  seconds between scans (default: 1.0)
+"""
+
+from collections.abc import Callable
+from dataclasses import dataclass
+import logging
+import os
+import pathlib
+import threading
+
+import scene_cache
+import story_loader
+
+logger = logging.getLogger("novelgame.story_watcher")
+
+Snapshot = dict[str, tuple[int, int]]  # relative file name → (mtime_ns, size)
+
+
+@dataclass(frozen=True, slots=True)
+class StoryChange:
+    story_id: str
+    story: story_loader.StoryData | None  # None: story directory was removed
+    scenes: frozenset[str] | None  # changed/removed scene_ids; None: whole story (new, meta or lazy rebuild)
+
+
+def snapshot_story(story_dir: pathlib.Path) -> Snapshot:
+    snap: Snapshot = {}
+    for base, prefix in ((story_dir, ""), (story_dir / "images", "images/")):
+        try:
+            with os.scandir(base) as it:
+                for entry in it:
+                    if entry.is_file() and (prefix or entry.name.endswith(".yaml")):
+                        st = entry.stat()
+                        snap[prefix + entry.name] = (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            pass
+    return snap
+
+
+class StoryWatcher:
+    def __init__(self, novel_dir: pathlib.Path, stories: list[story_loader.StoryData],
+                 apply: Callable[[StoryChange], None], interval: float = 1.0,
+                 cache: scene_cache.SceneCache | None = None):
+        self.novel_dir = novel_dir
+        self.apply = apply
+        self.interval = interval
+        self.cache = cache  # lazy モードのときだけ使う
+        self.reloads = 0
+        self._stories = {story.story_id: story for story in stories}
+        self._snapshots = {sid: snapshot_story(novel_dir / sid) for sid in self._stories}
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def _rebuild(self, story_dir: pathlib.Path, old: story_loader.StoryData | None,
+                 before: Snapshot, after: Snapshot) -> StoryChange:
+        story_id = story_dir.name
+        if old is None or self.cache is not None:
+            # 新規ストーリー、または lazy モード（索引の再構築だけで済む）
+            if self.cache is not None:
+                self.cache.invalidate(story_id)
+                story = story_loader.index_story_dir(story_dir, self.cache)
+            else:
+                story = story_loader.parse_story_dir(story_dir)
+            return StoryChange(story_id, story, None)
+
+        changed = {name for name in before.keys() | after.keys() if before.get(name) != after.get(name)}
+        meta = story_loader.parse_meta(story_dir) if "meta.yaml" in changed else old.meta
+        scenes = dict(old.scenes)
+        files = dict(old.files)
+        touched: set[str] = set()
+        for name in sorted(changed):
+            if name == "meta.yaml" or not name.endswith(".yaml") or "/" in name:
+                continue
+            old_id = files.pop(name, None)
+            if old_id is not None:
+                scenes.pop(old_id, None)
+                touched.add(old_id)
+            if name not in after:
+                continue  # 削除されたシーン
+            try:
+                scene_id, doc = story_loader.parse_scene_file(story_dir / name)
+            except Exception as e:
+                logger.error("Error loading scene file %s: %s", story_dir / name, e)
+                continue
+            scenes[scene_id] = doc
+            files[name] = scene_id
+            touched.add(scene_id)
+        images = story_loader.images_for(story_dir, scenes)
+        changed_images = {name.removeprefix("images/") for name in changed if name.startswith("images/")}
+        for scene_id in images.keys() | old.images.keys():
+            path = images.get(scene_id)
+            if path != old.images.get(scene_id) or (path is not None and os.path.basename(path) in changed_images):
+                touched.add(scene_id)
+        story = story_loader.StoryData(story_id, meta, scenes, images, files)
+        return StoryChange(story_id, story, None if "meta.yaml" in changed else frozenset(touched))
+
+    def poll(self) -> list[StoryChange]:
+        """Scan once and apply every change. Returns the applied changes."""
+        changes = []
+        current = {p.name: p for p in story_loader.story_dirs(self.novel_dir)}
+        for story_id in list(self._stories.keys() - current.keys()):
+            del self._stories[story_id]
+            del self._snapshots[story_id]
+            if self.cache is not None:
+                self.cache.invalidate(story_id)
+            changes.append(StoryChange(story_id, None, None))
+        for story_id, story_dir in current.items():
+            after = snapshot_story(story_dir)
+            before = self._snapshots.get(story_id)
+            if before == after:
+                continue
+            change = self._rebuild(story_dir, self._stories.get(story_id), before or {}, after)
+            self._stories[story_id] = change.story
+            self._snapshots[story_id] = after
+            changes.append(change)
+        for change in changes:
+            self.apply(change)
+            self.reloads += 1
+            logger.info("Reloaded story %s (scenes: %s)", change.story_id,
+                        sorted(change.scenes) if change.scenes is not None else "all")
+        return changes
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:  # 監視スレッドは止めない
+                logger.exception("Error while reloading stories: %s", e)
+
+    def start(self) -> "StoryWatcher":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="story-watcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def watch_enabled() -> bool:
+    return os.environ.get("NOVEL_WATCH_STORIES", "0") == "1"
+
+
+def watch_interval() -> float:
+    return float(os.environ.get("NOVEL_WATCH_INTERVAL", 1.0))
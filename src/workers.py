@@ -0,0 +1,233 @@
+"""Multi-worker deployment over the HTTP/SSE transport.
+
+Runs N copies of a server (``server`` or ``server_tool``) as separate
+processes on ``port+1 .. port+N`` and a small router on ``port``. Clients
+connect to ``http://host:port/sse?player_id=<id>``; the router pins the SSE
+connection, and every message posted on it, to worker
+``crc32(player_id) % N`` (sticky routing). Connections without a player_id
+are spread round-robin.
+
+Workers share player state through SQLite in WAL mode: sessions
+(``NOVEL_SESSION_SHARED=1``, read from and written through to the store on
+every call) and the event log. Log events written by one worker become
+visible to the others at its next group commit (within ``max_delay``, 50 ms).
+Stories and the image / bundle caches are read-only or written atomically, so
+the workers share those directories as is.
+
+    uv run src/workers.py --server server_tool --workers 4 --port 8000
+
+A single server picks its transport from the environment (see :func:`run`),
+which is how the workers are started.
+
+Configuration (environment):
+    NOVEL_TRANSPORT  "stdio" (default) or "sse"
+    NOVEL_HOST       SSE bind address (default: 127.0.0.1)
+    NOVEL_PORT       SSE port (default: 8000)
+"""
+
+from collections import Counter
+from collections.abc import Sequence
+import argparse
+import itertools
+import json
+import logging
+import os
+import pathlib
+import re
+import signal
+import socket
+import subprocess
+import sys
+import time
+import zlib
+
+import httpx
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+import uvicorn
+
+import metrics
+
+logger = logging.getLogger("novelgame.workers")
+
+ROOT = pathlib.Path(__file__).parent
+SHARED_ENV = {
+    "NOVEL_SESSION_STORE": "sqlite",
+    "NOVEL_SESSION_SHARED": "1",
+    "NOVEL_LOG_BACKEND": "sqlite",
+    "NOVEL_LOG_SHARED": "1",
+}
+_SESSION_ID = re.compile(rb"session_id=([0-9a-f]+)")
+
+
+def transport_from_env() -> dict:
+    """Keyword arguments for ``mcp.run()`` from NOVEL_TRANSPORT / NOVEL_HOST / NOVEL_PORT."""
+    transport = os.environ.get("NOVEL_TRANSPORT", "stdio")
+    if transport == "stdio":
+        return {"transport": "stdio"}
+    if transport == "sse":
+        return {
+            "transport": "sse",
+            "host": os.environ.get("NOVEL_HOST", "127.0.0.1"),
+            "port": int(os.environ.get("NOVEL_PORT", 8000)),
+        }
+    raise ValueError(f"Unknown NOVEL_TRANSPORT: {transport}")
+
+
+def run(mcp) -> None:
+    """``mcp.run()`` on the transport from the environment.
+
+    uvicorn re-raises SIGTERM after its own shutdown; turning it into SystemExit
+    lets the atexit handlers flush the event log and sessions.
+    """
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    mcp.run(**transport_from_env())
+
+
+def worker_index(player_id: str, workers: int) -> int:
+    """Stable worker for a player (``hash()`` is salted per process, crc32 is not)."""
+    return zlib.crc32(player_id.encode("utf-8")) % workers
+
+
+def worker_env(base: dict[str, str] | None = None) -> dict[str, str]:
+    """Environment for workers: sessions and event log in shared SQLite files (paths may still be overridden)."""
+    env = dict(os.environ if base is None else base)
+    for key, value in SHARED_ENV.items():
+        if env.get(key, value) != value:
+            logger.warning("Overriding %s=%s with %s for multi-worker mode", key, env[key], value)
+        env[key] = value
+    return env
+
+
+def spawn_workers(server: str, count: int, host: str, port: int,
+                  env: dict[str, str] | None = None) -> list[subprocess.Popen]:
+    """Start ``count`` workers of ``src/<server>.py`` on ``port+1 ..``."""
+    env = worker_env(env)
+    procs = []
+    for i in range(count):
+        procs.append(subprocess.Popen(
+            [sys.executable, str(ROOT / f"{server}.py")],
+            env={**env, "NOVEL_TRANSPORT": "sse", "NOVEL_HOST": host, "NOVEL_PORT": str(port + 1 + i)},
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,  # 読み込み時のデバッグ出力
+        ))
+    return procs
+
+
+def wait_ready(host: str, ports: Sequence[int], timeout: float = 60.0) -> None:
+    """Block until every port accepts connections."""
+    deadline = time.monotonic() + timeout
+    for port in ports:
+        while True:
+            try:
+                socket.create_connection((host, port), timeout=1.0).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"worker on {host}:{port} did not start")
+                time.sleep(0.1)
+
+
+def stop_workers(procs: Sequence[subprocess.Popen]) -> None:
+    for proc in procs:
+        proc.terminate()
+    for proc in procs:
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+class Router:
+    """Sticky SSE proxy: player_id → worker for the stream, session_id → worker for posted messages."""
+
+    def __init__(self, upstreams: Sequence[str]):
+        self.upstreams = list(upstreams)
+        self.sessions: dict[str, str] = {}  # SSE session_id → upstream
+        self.routed: Counter[str] = Counter()
+        self._next = itertools.count()
+        self._client = httpx.AsyncClient(timeout=httpx.Timeout(30.0, read=None))
+
+    def pick(self, player_id: str | None) -> str:
+        if player_id:
+            return self.upstreams[worker_index(player_id, len(self.upstreams))]
+        return self.upstreams[next(self._next) % len(self.upstreams)]
+
+    async def sse(self, request: Request) -> Response:
+        upstream = self.pick(request.query_params.get("player_id"))
+        self.routed[upstream] += 1
+        resp = await self._client.send(
+            self._client.build_request("GET", upstream + "/sse", headers={"accept": "text/event-stream"}),
+            stream=True,
+        )
+
+        async def relay():
+            session_id, head = None, b""
+            try:
+                async for chunk in resp.aiter_raw():
+                    if session_id is None:
+                        # 最初の endpoint イベントから session_id を拾い、以降の POST を同じワーカーへ送る
+                        head += chunk
+                        m = _SESSION_ID.search(head)
+                        if m:
+                            session_id = m.group(1).decode()
+                            self.sessions[session_id] = upstream
+                            head = b""
+                    yield chunk
+            finally:
+                await resp.aclose()
+                if session_id is not None:
+                    self.sessions.pop(session_id, None)
+
+        return StreamingResponse(relay(), status_code=resp.status_code, media_type="text/event-stream",
+                                 headers={"cache-control": "no-cache"})
+
+    async def messages(self, request: Request) -> Response:
+        upstream = self.sessions.get(request.query_params.get("session_id", ""))
+        if upstream is None:
+            return Response("Could not find session", status_code=404)
+        resp = await self._client.post(
+            upstream + "/messages/",
+            params=request.query_params,
+            content=await request.body(),
+            headers={"content-type": request.headers.get("content-type", "application/json")},
+        )
+        return Response(resp.content, status_code=resp.status_code, media_type=resp.headers.get("content-type"))
+
+    async def stats(self, request: Request) -> Response:
+        body = {"workers": self.upstreams, "sessions": len(self.sessions), "routed": dict(self.routed)}
+        return Response(json.dumps(body), media_type="application/json")
+
+    def app(self) -> Starlette:
+        return Starlette(routes=[
+            Route("/sse", self.sse),
+            Route("/messages/", self.messages, methods=["POST"]),
+            Route("/workers", self.stats),
+        ])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", choices=("server", "server_tool"), default="server_tool")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000, help="router port; workers listen on port+1 ..")
+    args = parser.parse_args()
+
+    metrics.configure_logging()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))  # finally でワーカーを止める
+    procs = spawn_workers(args.server, args.workers, args.host, args.port)
+    try:
+        ports = [args.port + 1 + i for i in range(args.workers)]
+        wait_ready(args.host, ports)
+        router = Router([f"http://{args.host}:{p}" for p in ports])
+        logger.info("Routing %s:%d → %d workers (%s)", args.host, args.port, args.workers, args.server)
+        uvicorn.run(router.app(), host=args.host, port=args.port, log_level="warning")
+    finally:
+        stop_workers(procs)
+
+
+if __name__ == "__main__":
+    main()